@@ -53,6 +53,21 @@ Output Data:
 def run(port=5000):
     current_app.run(port=port, debug=True)
 
+@as_command()
+def serve(host="127.0.0.1", port=8000, threads=0):
+    """Production server: the app under uvicorn, see common.asgi."""
+    from common.asgi import WsgiToAsgi
+
+    try:
+        import uvicorn
+    except ImportError:
+        print("Serving needs uvicorn: pip install uvicorn")
+        exit(1)
+
+    app = current_app._get_current_object()
+    uvicorn.run(WsgiToAsgi(app, int(threads) or app.config["ASGI_THREADS"]),
+            host=host, port=int(port), lifespan="on")
+
 @as_command()
 def test(dbecho=False, record=""):
     global _RECORD_STR
@@ -88,6 +103,119 @@ def initdb(drop=False):
     else:
         g.db.drop_all()
 
+@as_command()
+def import_accounts(path, chunk=1000):
+    import csv
+    import json
+    import time
+    import common.models
+    from api.auth.account import create_accounts
+
+    def rows():
+        with open(path) as f:
+            if path.endswith(".csv"):
+                for row in csv.DictReader(f):
+                    yield row
+            else:
+                for line in f:
+                    if line.strip():
+                        yield json.loads(line)
+
+    started = time.time()
+    counts = { 'uid': 0, 'duplicated': 0, 'error': 0 }
+
+    for result in create_accounts(rows(), int(chunk)):
+        for k in counts:
+            if k in result: counts[k] += 1
+        if 'uid' not in result:
+            print(json.dumps(result))
+
+    elapsed = time.time() - started
+    print("Created %d, duplicated %d, invalid %d in %.2fs (%.0f rows/s)" % (
+        counts['uid'], counts['duplicated'], counts['error'], elapsed,
+        sum(counts.values()) / elapsed if elapsed else 0))
+
+@as_command()
+def reap_sessions(batch=1000):
+    import json
+
+    stats = current_app.session_interface.reap(current_app, int(batch))
+    print(json.dumps(stats, indent=4, sort_keys=True))
+
+@as_command()
+def bench(db="memory,file", concurrency=4, requests=200, mix="", output=""):
+    import json
+    import bench.load
+
+    result = bench.load.run(db, concurrency, requests,
+            mix or bench.load.DEFAULT_MIX)
+    data = json.dumps(result, indent=4, sort_keys=True)
+
+    if output:
+        with open(output, "w") as f:
+            f.write(data)
+    else:
+        print(data)
+
+@as_command()
+def microbench(name=None, **kwargs):
+    import json
+    import bench
+
+    if name not in bench.get_benchmarks():
+        print("Available benchmarks:")
+        for ln in bench.get_benchmarks():
+            print("    " + ln)
+        return
+
+    mod = __import__("bench." + name, fromlist=["run"])
+    print(json.dumps(mod.run(**kwargs), indent=4, sort_keys=True))
+
+@as_command()
+def build_manifest(path="", stamp=""):
+    import api
+
+    resources = api.write_manifest(path or api.MANIFEST, stamp or None)
+    print("%d resources written to %s" % (len(resources), path or api.MANIFEST))
+
+_BOOT_CODE = """
+import time
+started = time.time()
+import common.init
+app = common.init.get_app()
+app.config["API_MANIFEST"] = %r
+with app.app_context():
+    common.init.init_everything()
+print(time.time() - started)
+"""
+
+@as_command()
+def import_profile(top=20, manifest=False):
+    """Boot a worker in a fresh interpreter and report the slowest imports."""
+    import subprocess
+
+    proc = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c",
+                _BOOT_CODE % bool(manifest)],
+            cwd = os.path.dirname(os.path.abspath(__file__)),
+            stdout = subprocess.PIPE, stderr = subprocess.PIPE,
+            universal_newlines = True, check = True)
+
+    # import time: self [us] | cumulative | imported package
+    imports = []
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        self_us, cumulative, name = line[len("import time:"):].split("|")
+        imports.append((int(cumulative), int(self_us), name.rstrip()))
+
+    print("Boot time: %.1fms, %d modules imported" % (
+            float(proc.stdout.strip().splitlines()[-1]) * 1000, len(imports)))
+    print("%12s %12s  module" % ("cumul. [ms]", "self [ms]"))
+    for cumulative, self_us, name in sorted(imports, reverse=True)[:int(top)]:
+        print("%12.1f %12.1f  %s" % (cumulative / 1000.0, self_us / 1000.0,
+                name))
+
 @as_command()
 def help(func=None):
     global registered_command
@@ -1,18 +1,98 @@
-def get_blueprint():
-    from flask.ext.restful import Api
-    from flask import Blueprint
+import os
+import json
 
-    from common.utils import find_modules, join_url
+# Resources of the blueprint, written by ./admin.py build_manifest so that
+# workers register them without scanning the packages, see API_MANIFEST.
+MANIFEST = os.path.join(os.path.dirname(__file__), "manifest.json")
 
-    bp = Blueprint('api', __name__)
-    api = Api(bp)
+def scan_resources():
+    """
+    Import every api package and list its resources as (resource, url,
+    endpoint).
+    """
+    from common.utils import find_modules, join_url
 
+    resources = []
     for modname in find_modules(__file__):
         mod = __import__(modname, globals=globals(), locals=locals(), level=1)
         if hasattr(mod, "get_entries"):
             for entname, entry in mod.get_entries():
-                api.add_resource(entry, join_url(modname, entname),
-                        endpoint="{}.{}".format(modname, entname))
+                resources.append((entry, join_url(modname, entname),
+                        "{}.{}".format(modname, entname)))
 
-    return bp
+    return resources
+
+def write_manifest(path=MANIFEST, stamp=None):
+    resources = [{
+            'module': entry.__module__,
+            'class': entry.__name__,
+            'url': url,
+            'endpoint': endpoint,
+        } for entry, url, endpoint in scan_resources()]
+
+    with open(path, "w") as f:
+        json.dump({ 'stamp': stamp, 'resources': resources },
+                f, indent=4, sort_keys=True)
+
+    return resources
+
+def load_manifest(path=MANIFEST, stamp=None):
+    """
+    The resources listed in the manifest, or None if it is missing, was
+    built with another stamp or lists resources which are gone. The stamp
+    is trusted: the modules on disk aren't looked at.
+    """
+    import importlib
+    import logging
+
+    try:
+        with open(path) as f:
+            manifest = json.load(f)
+        if manifest['stamp'] != stamp:
+            raise ValueError("built for %r, not %r" % (
+                    manifest['stamp'], stamp))
+        return [(getattr(importlib.import_module(r['module']), r['class']),
+                r['url'], r['endpoint']) for r in manifest['resources']]
+    except (IOError, ValueError, KeyError, TypeError,
+            ImportError, AttributeError) as e:
+        logging.getLogger(__name__).warning(
+                "Ignoring the api manifest %s: %s", path, e)
+        return None
 
+def get_blueprint():
+    from flask_restful import Api
+    from flask import Blueprint, current_app
+
+    from common.error import ApiError
+    from common.utils import conditional
+    from common.ratelimit import rate_limited
+    from common.instrument import timed_representation
+    from common.representation import get_encoder, representation
+
+    class ApiErrorsApi(Api):
+        def handle_error(self, e):
+            # Api would answer them with a 500, leave them to error_handler
+            if isinstance(e, ApiError):
+                raise e
+            return Api.handle_error(self, e)
+
+    bp = Blueprint('api', __name__)
+    # the last decorator is the outermost: throttle before anything else
+    api = ApiErrorsApi(bp, decorators=[conditional, rate_limited])
+
+    api.representations['application/json'] = representation(
+            get_encoder(current_app.config["API_JSON_ENCODER"]))
+    for mediatype, func in list(api.representations.items()):
+        api.representations[mediatype] = timed_representation(func)
+
+    resources = None
+    if current_app.config["API_MANIFEST"] and os.path.exists(MANIFEST):
+        resources = load_manifest(
+                stamp=current_app.config["API_MANIFEST_STAMP"])
+    if resources is None:
+        resources = scan_resources()
+
+    for entry, url, endpoint in resources:
+        api.add_resource(entry, url, endpoint=endpoint)
+
+    return bp
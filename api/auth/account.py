@@ -1,64 +1,208 @@
 import re
+import uuid
 
-import flask.ext.restful as restful
-from flask.ext.restful import reqparse
+import flask_restful as restful
+from flask_restful.reqparse import Argument
 from sqlalchemy.exc import IntegrityError
 
 from flask import g
+from sqlalchemy import and_, or_
 from common.utils import (
+        name_type,
         email_type,
         phone_type,
         md5_hashed_type,
+        arguments,
+        stateless,
     )
 from common.error import *
 import common.models as models
+from common.init import (
+        invalidate_user,
+        credential_key,
+        get_credential_filter,
+    )
 
+@stateless
 class Account(restful.Resource):
-    def post(self):
-        parser = reqparse.RequestParser()
-        parser.add_argument('name', required=True)
-        parser.add_argument('email', type=email_type)
-        parser.add_argument('phone', type=phone_type)
-        parser.add_argument('passwd', type=md5_hashed_type)
-
-        args = parser.parse_args()
+    @arguments(
+        Argument('name', type=name_type, required=True),
+        Argument('email', type=email_type),
+        Argument('phone', type=phone_type),
+        Argument('passwd', type=md5_hashed_type),
+    )
+    def post(self, args):
+        creds = [(t, args[t]) for t in ('name', 'email', 'phone') if args[t]]
+        if _taken_credentials(creds):
+            raise AccountAlreadyExists()
 
         new_account = models.Account(
                 passwd = args['passwd'],
             )
         g.db.session.add(new_account)
         g.db.session.flush()
+        # the commit expires new_account, don't reload it for its uid
+        uid = new_account.uid
 
-        new_username = models.Credential(
-                cred_type = 'name',
-                cred_value = args['name'],
-                uid = new_account.uid
-            )
-        g.db.session.add(new_username)
-
-        if args['email']:
-            new_email = models.Credential(
-                    cred_type = 'email',
-                    cred_value = args['email'],
-                    uid = new_account.uid
-                )
-            g.db.session.add(new_email)
-
-        if args['phone']:
-            new_phone = models.Credential(
-                    cred_type = 'phone',
-                    cred_value = args['phone'],
-                    uid = new_account.uid
-                )
-            g.db.session.add(new_phone)
+        for cred_type, cred_value in creds:
+            g.db.session.add(models.Credential(
+                    cred_type = cred_type,
+                    cred_value = cred_value,
+                    uid = uid
+                ))
 
         try:
             g.db.session.commit()
         except IntegrityError:
+            # taken by another writer since the check
+            g.db.session.rollback()
             raise AccountAlreadyExists()
-            
 
-        return { 'uid': new_account.uid }
+        _remember_credentials(creds)
+        invalidate_user(uid)
+
+        return { 'uid': uid }
+
+################################################################################
+# Bulk Creation
+
+_CRED_TYPES = [
+        ('name', None),
+        ('email', email_type),
+        ('phone', phone_type),
+    ]
+
+_CRED_MAX_LENGTH = models.Credential.__table__.c.cred_value.type.length
+
+def _validate(row):
+    if not isinstance(row, dict) or not row.get('name'):
+        raise ValueError("Missing name.")
+
+    creds = []
+    for cred_type, check in _CRED_TYPES:
+        value = row.get(cred_type)
+        if not value:
+            continue
+        if not isinstance(value, str):
+            raise ValueError("%s must be a string." % cred_type.capitalize())
+        if len(value) > _CRED_MAX_LENGTH:
+            raise ValueError("%s is longer than %d characters." % (
+                    cred_type.capitalize(), _CRED_MAX_LENGTH))
+        creds.append((cred_type, check(value) if check else value))
+
+    passwd = row.get('passwd') or ""
+    if not isinstance(passwd, str):
+        raise ValueError("Passwd must be a string.")
+
+    return md5_hashed_type(passwd), creds
+
+def _existing_credentials(creds):
+    by_type = {}
+    for cred_type, cred_value in creds:
+        by_type.setdefault(cred_type, []).append(cred_value)
+    if not by_type:
+        return set()
+
+    # one statement for all types
+    Credential = models.Credential
+    return set(tuple(r) for r in g.db.session.query(
+            Credential.cred_type, Credential.cred_value)
+        .filter(or_(*[and_(Credential.cred_type == cred_type,
+            Credential.cred_value.in_(values))
+            for cred_type, values in by_type.items()])))
+
+def _taken_credentials(creds):
+    """
+    The credentials of creds already in the table. Those the credential
+    filter has never seen are taken as free without a query.
+    """
+    bloom = get_credential_filter()
+    if bloom is not None:
+        keys = [(c, credential_key(*c)) for c in creds]
+        creds = [c for c, key in keys if key is None or key in bloom]
+    return _existing_credentials(creds)
+
+def _remember_credentials(creds):
+    bloom = get_credential_filter()
+    if bloom is not None:
+        for cred in creds:
+            key = credential_key(*cred)
+            if key is not None:
+                bloom.add(key)
+
+def _create_chunk(chunk):
+    results = {}
+    valid = []
+
+    for i, row in chunk:
+        try:
+            valid.append((i,) + _validate(row))
+        except ValueError as e:
+            results[i] = { 'row': i, 'error': str(e) }
+
+    # credentials in the table, or claimed by an earlier row of the chunk
+    taken = _taken_credentials(
+            set(c for _, _, creds in valid for c in creds))
+
+    accounts = []
+    credentials = []
+    for i, passwd, creds in valid:
+        duplicated = [t for t, v in creds if (t, v) in taken]
+        if duplicated:
+            results[i] = { 'row': i, 'duplicated': duplicated }
+            continue
+        taken.update(creds)
+
+        uid = str(uuid.uuid4())
+        accounts.append({ 'uid': uid, 'passwd': passwd })
+        credentials += [{ 'cred_type': t, 'cred_value': v, 'uid': uid }
+                for t, v in creds]
+        results[i] = { 'row': i, 'uid': uid }
+
+    try:
+        if accounts:
+            g.db.session.execute(models.Account.__table__.insert(), accounts)
+            g.db.session.execute(
+                    models.Credential.__table__.insert(), credentials)
+        g.db.session.commit()
+        _remember_credentials(
+                (c['cred_type'], c['cred_value']) for c in credentials)
+    except IntegrityError:
+        # lost a race against another writer, retry row by row
+        g.db.session.rollback()
+        if len(chunk) > 1:
+            return sum((_create_chunk([c]) for c in chunk), [])
+
+        i, passwd, creds = valid[0]
+        results[i] = { 'row': i, 'duplicated':
+                [t for t, v in creds if (t, v) in _existing_credentials(creds)]
+                or [t for t, v in creds] }
+
+    return [results[i] for i, _ in chunk]
+
+def create_accounts(rows, chunk_size=1000):
+    """
+    Create an account for every dict in rows (name, and optionally email,
+    phone and passwd), committing chunk_size accounts at a time. Yields one
+    result per row:
+
+        { 'row': 0, 'uid': '...' }                  created
+        { 'row': 1, 'duplicated': ['name'] }        credentials already taken
+        { 'row': 2, 'error': 'Not MD5 Hashed.' }    invalid row
+
+    """
+    chunk = []
+
+    for i, row in enumerate(rows):
+        chunk.append((i, row))
+        if len(chunk) >= chunk_size:
+            for result in _create_chunk(chunk):
+                yield result
+            chunk = []
+
+    if chunk:
+        for result in _create_chunk(chunk):
+            yield result
 
 Entry = Account
 
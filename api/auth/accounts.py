@@ -0,0 +1,32 @@
+import flask_restful as restful
+
+from flask import current_app
+from flask_restful.reqparse import Argument
+
+from common.utils import arguments, stateless, admin_only, json_array_type
+from common.error import BatchTooLarge
+from .account import create_accounts
+
+@stateless
+class Accounts(restful.Resource):
+    """
+    Create accounts in batch, for operators onboarding a semester. Needs the
+    ADMIN_TOKEN, and takes at most ACCOUNTS_BATCH_MAX rows per request.
+    """
+
+    chunk_size = 500
+
+    @admin_only
+    @arguments(
+        Argument('accounts', type=json_array_type, location='json',
+            required=True),
+    )
+    def post(self, args):
+        limit = current_app.config["ACCOUNTS_BATCH_MAX"]
+        if len(args['accounts']) > limit:
+            raise BatchTooLarge(limit)
+
+        return { 'accounts':
+                list(create_accounts(args['accounts'], self.chunk_size)) }
+
+Entry = Accounts
@@ -1,7 +1,9 @@
-import flask.ext.restful as restful
-import flask.ext.login as login
+import hmac
 
-from flask.ext.restful import reqparse
+import flask_restful as restful
+import flask_login as login
+
+from flask_restful.reqparse import Argument
 from flask import g
 
 from common.models import Credential, Account
@@ -9,47 +11,76 @@ from common.utils import (
         email_type,
         phone_type,
         md5_hashed_type,
+        arguments,
     )
 from common.error import (
         AtLeastOneOfArguments,
         CredentialNotFound,
         PasswordIncorrect,
     )
+from common.ratelimit import Limit
+from common.init import get_passwd_cache
 
 class Login(restful.Resource):
-    def post(self):
-        parser = reqparse.RequestParser()
-        parser.add_argument('uid')
-        parser.add_argument('name')
-        parser.add_argument('email', type=email_type)
-        parser.add_argument('phone', type=phone_type)
-        parser.add_argument('passwd', type=md5_hashed_type, default="")
-        args = parser.parse_args()
+    # per client, then per account tried from any number of clients. Behind
+    # a reverse proxy, the client is only told apart with
+    # RATELIMIT_TRUSTED_PROXIES set, see common.ratelimit
+    rate_limits = {
+        'POST': [
+            Limit('ip', 60, 60),
+            Limit('uid', 10, 60),
+            Limit('credential', 10, 60),
+        ],
+    }
+
+    @arguments(
+        Argument('uid'),
+        Argument('name'),
+        Argument('email', type=email_type),
+        Argument('phone', type=phone_type),
+        Argument('passwd', type=md5_hashed_type, default=""),
+    )
+    def post(self, args):
+        cache = get_passwd_cache()
 
-        account = None
+        # a password verified recently doesn't need the account
+        if args['uid'] and cache is not None and \
+                cache.verify(args['uid'], args['passwd']):
+            login.login_user(Account(uid=args['uid']))
+            return { "uid": args['uid'] }
 
+        # resolve the credential to (uid, passwd) in a single statement
         if args['uid']:
-            account = Account.query.get(args['uid'])
+            row = g.db.session.query(Account.uid, Account.passwd) \
+                    .filter(Account.uid == args['uid']).first()
+            if not row:
+                raise AtLeastOneOfArguments(['uid', 'name', 'email', 'phone'])
         else:
             cred_type = \
                 'name'  if args['name' ] else \
                 'email' if args['email'] else \
                 'phone' if args['phone'] else ''
-            cred = Credential.query.get(
-                    (cred_type, args[cred_type]))
-            if not cred.account:
-                raise CredentialNotFound(cred_type, args[cred_type]);
-            account = cred.account
+            if not cred_type:
+                raise AtLeastOneOfArguments(['uid', 'name', 'email', 'phone'])
 
-        if not account:
-            raise AtLeastOneOfArguments(['uid', 'name', 'email', 'phone'])
+            row = g.db.session.query(Credential.uid, Account.passwd) \
+                    .join(Credential.account) \
+                    .filter(Credential.cred_type == cred_type) \
+                    .filter(Credential.cred_value == args[cred_type]).first()
+            if not row:
+                raise CredentialNotFound(cred_type, args[cred_type]);
 
-        if account.passwd.lower() != args['passwd'].lower():
+        uid, passwd = row
+        if not hmac.compare_digest((passwd or "").lower().encode('utf8'),
+                args['passwd'].lower().encode('utf8')):
             raise PasswordIncorrect()
 
-        login.login_user(account)
+        if cache is not None:
+            cache.remember(uid, passwd)
 
-        return { "uid": account.uid }
+        # login_user only needs the identity, don't load the whole row
+        login.login_user(Account(uid=uid))
 
-Entry = Login
+        return { "uid": uid }
 
+Entry = Login
@@ -1,5 +1,5 @@
-import flask.ext.restful as restful
-import flask.ext.login as login
+import flask_restful as restful
+import flask_login as login
 
 from flask import session
 
@@ -1,17 +1,24 @@
 import unittest
 import werkzeug
 import hashlib
+import pickle
 import json
+import tempfile
 
-from flask import current_app, url_for, session
+from datetime import datetime, timedelta
+
+from flask import g, current_app, url_for, session
+from flask import request as flask_request
 
 from common.models import (
         Account,
         Credential,
         UserInfo,
+        Session,
     )
 from common.error import *
 from common.utils import ApiTest, test_context
+from common.init import get_user_cache
 
 class AuthTest(ApiTest):
 
@@ -72,6 +79,140 @@ class AuthTest(ApiTest):
         self.assertEqual(response.status_code, 400)
         self.assertApiError(data, AccountAlreadyExists)
 
+    @test_context
+    def test_create_account_without_name(self):
+        response = self.post(
+                endpoint = "api.auth.account",
+                data = { 'name': '', 'email': 'nameless@gump.com' }
+            )
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.dbsess.query(Account).count(), 2)
+
+    @test_context
+    def test_create_account_checks_credentials_first(self):
+        import common.init
+        # warm it with the rows of this test
+        common.init.warm_credential_filter()
+
+        with self.assertMaxQueries(1) as statements:
+            response = self.post(
+                    endpoint = "api.auth.account",
+                    data = { 'name': 'forrest', 'email': 'gump@gump.com' }
+                )
+        self.assertApiError(self.load_data(response.data),
+                AccountAlreadyExists)
+        self.assertFalse([s for s in statements if 'INSERT' in s])
+
+        # names the filter has never seen aren't looked up
+        with self.assertMaxQueries(3) as statements:
+            response = self.post(
+                    endpoint = "api.auth.account",
+                    data = { 'name': 'forrest' }
+                )
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse([s for s in statements if 'SELECT' in s])
+
+    @test_context
+    def test_credential_filter_not_built_by_requests(self):
+        import common.init
+
+        common.init._credential_filter = None
+        self.assertIsNone(common.init.credential_key('name', 42))
+
+        # checked exactly until warmed in the background
+        response = self.post(
+                endpoint = "api.auth.account",
+                data = { 'name': 'john' }
+            )
+        self.assertApiError(self.load_data(response.data),
+                AccountAlreadyExists)
+        self.assertIsNone(common.init.get_credential_filter())
+
+    def test_bloom_filter(self):
+        from common.bloom import BloomFilter
+
+        bloom = BloomFilter(1000, 0.01)
+        for i in range(1000):
+            bloom.add('name:user%d' % i)
+
+        self.assertTrue(all('name:user%d' % i in bloom for i in range(1000)))
+        self.assertLess(sum('name:other%d' % i in bloom
+            for i in range(1000)), 50)
+
+    @test_context
+    def test_create_accounts_in_batch(self):
+        response = self.post(
+                endpoint = "api.auth.accounts",
+                headers = { 'X-Admin-Token': "test-admin-token" },
+                content_type = "application/json",
+                data = json.dumps({ 'accounts': [
+                    { 'name': 'bill', 'email': 'bill@gump.com' },
+                    { 'name': 'john' },
+                    { 'name': 'ben', 'email': 'bill@gump.com' },
+                    { 'name': 'bob', 'passwd': 'plain' },
+                ] })
+            )
+        data = self.load_data(response.data)['accounts']
+
+        self.assertEqual(response.status_code, 200)
+        self.assertRegexpMatches(data[0]["uid"], "[0-9a-z\-]{36}")
+        self.assertEqual(data[1]["duplicated"], ['name'])
+        self.assertEqual(data[2]["duplicated"], ['email'])
+        self.assertIn("error", data[3])
+        self.assertEqual(self.dbsess.query(Credential)
+                .filter_by(uid = data[0]["uid"]).count(), 2)
+
+    @test_context
+    def test_create_accounts_for_admins_only(self):
+        def post(accounts, token="test-admin-token"):
+            return self.client.post(url_for("api.auth.accounts"),
+                    headers = { 'X-Admin-Token': token },
+                    content_type = "application/json",
+                    data = json.dumps({ 'accounts': accounts }))
+
+        response = post([{ 'name': 'bill' }], token = "guess")
+        self.assertEqual(response.status_code, 403)
+        self.assertApiError(self.load_data(response.data),
+                AdminTokenRequired)
+
+        current_app.config["ADMIN_TOKEN"] = None
+        try:
+            self.assertEqual(post([{ 'name': 'bill' }]).status_code, 404)
+        finally:
+            current_app.config["ADMIN_TOKEN"] = "test-admin-token"
+
+        # only a JSON array, not anything list() iterates over
+        for accounts in ["notalist", { 'name': 'bill' }]:
+            self.assertEqual(post(accounts).status_code, 400)
+
+        limit = current_app.config["ACCOUNTS_BATCH_MAX"]
+        response = post([{ 'name': 'user%d' % i } for i in range(limit + 1)])
+        self.assertEqual(response.status_code, 400)
+        self.assertApiError(self.load_data(response.data), BatchTooLarge)
+        self.assertEqual(self.dbsess.query(Account).count(), 2)
+
+    @test_context
+    def test_create_accounts_rejects_malformed_rows(self):
+        response = self.post(
+                endpoint = "api.auth.accounts",
+                headers = { 'X-Admin-Token': "test-admin-token" },
+                content_type = "application/json",
+                data = json.dumps({ 'accounts': [
+                    { 'name': 'carl', 'phone': 123 },
+                    { 'name': 'dave', 'passwd': 5 },
+                    { 'name': ['l'] },
+                    { 'name': 'x' * 65 },
+                    { 'name': 'eve' },
+                ] })
+            )
+        data = self.load_data(response.data)['accounts']
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([d['row'] for d in data if 'error' in d],
+                [0, 1, 2, 3])
+        self.assertIn('uid', data[4])
+
     @test_context
     def test_successful_login_no_password(self):
         response = self.post(
@@ -99,6 +240,28 @@ class AuthTest(ApiTest):
         self.assertRegexpMatches(data["uid"], "[0-9a-z\-]{36}")
         self.assertEqual(session["user_id"], self.account_1.uid)
 
+    @test_context
+    def test_login_by_credential_queries(self):
+        # credential lookup, then the session upsert
+        with self.assertMaxQueries(3):
+            response = self.post(
+                    endpoint = "api.auth.login",
+                    data = { 'name': 'gump', }
+                )
+
+        self.assertEqual(response.status_code, 200)
+
+    @test_context
+    def test_login_credential_not_found(self):
+        response = self.post(
+                endpoint = "api.auth.login",
+                data = { 'email': 'nobody@gump.com', }
+            )
+        data = self.load_data(response.data)
+
+        self.assertEqual(response.status_code, 400)
+        self.assertApiError(data, CredentialNotFound)
+
     @test_context
     def test_login_password_incorrect(self):
         response = self.post(
@@ -113,6 +276,109 @@ class AuthTest(ApiTest):
         self.assertEqual(response.status_code, 400)
         self.assertApiError(data, PasswordIncorrect)
 
+    @test_context
+    def test_login_password_cache(self):
+        passwd = self.account_1.passwd
+        self.login_user(self.account_1)
+
+        with self.assertMaxQueries(4) as statements:
+            self.login_user(self.account_1)
+        self.assertFalse([s for s in statements if 'geek_account' in s])
+
+        # changing the password forgets the cached one
+        self.account_1.passwd = hashlib.md5(b"456pass").hexdigest()
+        self.dbsess.commit()
+
+        response = self.post(
+                endpoint = "api.auth.login",
+                data = { 'uid': self.account_1.uid, 'passwd': passwd }
+            )
+        self.assertApiError(self.load_data(response.data), PasswordIncorrect)
+
+    @test_context
+    def test_password_cache_forgets_on_commit(self):
+        from common.init import get_passwd_cache
+
+        cache = get_passwd_cache()
+        cache.remember(self.account_1.uid, self.account_1.passwd)
+        cache.remember(self.account_2.uid, self.account_2.passwd)
+
+        # still the password of everyone else until committed
+        self.account_1.passwd = hashlib.md5(b"456pass").hexdigest()
+        self.dbsess.flush()
+        self.assertTrue(cache.verify(self.account_1.uid,
+            hashlib.md5(b"123pass").hexdigest()))
+        self.dbsess.rollback()
+        self.assertTrue(cache.verify(self.account_1.uid,
+            hashlib.md5(b"123pass").hexdigest()))
+
+        self.account_1.passwd = hashlib.md5(b"456pass").hexdigest()
+        self.dbsess.commit()
+        self.assertFalse(cache.verify(self.account_1.uid,
+            hashlib.md5(b"123pass").hexdigest()))
+        self.assertTrue(cache.verify(self.account_2.uid,
+            self.account_2.passwd))
+
+        cache.remember(self.account_1.uid, self.account_1.passwd)
+        self.dbsess.query(Credential).filter(
+                Credential.uid == self.account_1.uid).delete()
+        self.dbsess.delete(self.account_1)
+        self.dbsess.commit()
+        self.assertIsNone(cache.cache.get(self.account_1.uid))
+
+    @test_context
+    def test_login_rate_limited(self):
+        from common import ratelimit
+
+        current_app.config["RATELIMIT_ENABLED"] = True
+        ratelimit.reset()
+        try:
+            for i in range(10):
+                response = self.post(
+                        endpoint = "api.auth.login",
+                        data = { 'name': 'john', 'passwd': '0' * 32 }
+                    )
+                self.assertApiError(self.load_data(response.data),
+                        PasswordIncorrect)
+
+            with self.assertMaxQueries(0):
+                response = self.post(
+                        endpoint = "api.auth.login",
+                        data = { 'name': 'John', 'passwd': '0' * 32 }
+                    )
+            self.assertEqual(response.status_code, 429)
+            self.assertIn('Retry-After', response.headers)
+            self.assertApiError(self.load_data(response.data), TooManyRequests)
+
+            # other accounts are still let through
+            self.login_user(self.account_2)
+        finally:
+            current_app.config["RATELIMIT_ENABLED"] = False
+            ratelimit.reset()
+
+    def test_token_bucket(self):
+        from common.ratelimit import LocalBackend
+
+        backend = LocalBackend()
+        self.assertEqual([backend.consume('k', 2, 10, now=100)
+                for _ in range(2)], [0, 0])
+        self.assertAlmostEqual(backend.consume('k', 2, 10, now=100), 5)
+        self.assertEqual(backend.consume('k', 2, 10, now=105), 0)
+
+    def test_rate_limit_client_behind_proxy(self):
+        from common.ratelimit import KEYS
+
+        headers = { 'X-Forwarded-For': 'spoofed, 10.0.0.1, 10.0.0.2' }
+        try:
+            for proxies, client in [(0, '127.0.0.1'), (1, '10.0.0.2'),
+                    (2, '10.0.0.1'), (4, '127.0.0.1')]:
+                current_app.config["RATELIMIT_TRUSTED_PROXIES"] = proxies
+                with current_app.test_request_context(headers = headers,
+                        environ_base = { 'REMOTE_ADDR': '127.0.0.1' }):
+                    self.assertEqual(KEYS['ip'](), client)
+        finally:
+            current_app.config["RATELIMIT_TRUSTED_PROXIES"] = 0
+
     @test_context
     def test_logout_without_having_logged_in(self):
         response = self.post(
@@ -168,6 +434,103 @@ class AuthTest(ApiTest):
         self.assertEqual(response.status_code, 200)
         self.assertEqual(data['school'], self.account_2.user_info.school)
 
+    @test_context
+    def test_user_info_query_self_queries(self):
+        self.login_user(self.account_2)
+        get_user_cache().clear()
+
+        with self.assertMaxQueries(2):
+            response = self.get(
+                    endpoint = "api.auth.userinfo",
+                    data = { 'info': ['school'] }
+                )
+
+        self.assertEqual(response.status_code, 200)
+
+    @test_context
+    def test_user_info_query_selects_requested_columns(self):
+        query = {
+                'uid': self.account_2.uid,
+                'info': ['student_id', 'passwd'],
+            }
+        with self.assertMaxQueries(1) as statements:
+            response = self.get(endpoint = "api.auth.userinfo", data = query)
+        data = self.load_data(response.data)
+
+        self.assertEqual(data, { 'student_id': 2013999999 })
+        for statement in statements:
+            self.assertNotIn('introduction', statement)
+            self.assertNotIn('school', statement)
+
+    @test_context
+    def test_user_info_not_modified(self):
+        query = {
+                'uid': self.account_2.uid,
+                'info': ['school'],
+            }
+        response = self.get(endpoint = "api.auth.userinfo", data = query)
+        etag = response.headers['ETag']
+        last_modified = response.headers['Last-Modified']
+
+        for headers in [{ 'If-None-Match': etag },
+                { 'If-Modified-Since': last_modified }]:
+            # the session lookup and the version, but never the row
+            with self.assertMaxQueries(2) as statements:
+                response = self.client.get(url_for("api.auth.userinfo"),
+                        query_string = query, headers = headers)
+            self.assertEqual(response.status_code, 304)
+            self.assertNotIn('school', statements[-1])
+
+        response = self.client.get(url_for("api.auth.userinfo"),
+                query_string = query, headers = { 'If-None-Match': '"0"' })
+        self.assertEqual(response.status_code, 200)
+
+    @test_context
+    def test_user_info_self_etag_names_user(self):
+        self.dbsess.add(UserInfo(uid = self.account_1.uid, school = 'x'))
+        self.dbsess.commit()
+
+        etags = []
+        for account in [self.account_1, self.account_2]:
+            self.login_user(account)
+            response = self.get(endpoint = "api.auth.userinfo",
+                    data = { 'info': ['school'] })
+            self.assertIn('Cookie', response.headers['Vary'])
+            etags.append(response.headers['ETag'])
+
+        # same url and same version, but another user's info
+        self.assertNotEqual(etags[0], etags[1])
+        response = self.client.get(url_for("api.auth.userinfo"),
+                query_string = { 'info': ['school'] },
+                headers = { 'If-None-Match': etags[0] })
+        self.assertEqual(response.status_code, 200)
+
+    @test_context
+    def test_user_info_query_many(self):
+        query = {
+                'uid': [self.account_1.uid, self.account_2.uid],
+                'info': ['school', 'student_id'],
+            }
+        response = self.get(endpoint = "api.auth.userinfos", data = query)
+        data = self.load_data(response.data)['users']
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(list(data.keys()), [self.account_2.uid])
+        self.assertEqual(data[self.account_2.uid],
+                { 'school': self.account_2.user_info.school,
+                  'student_id': self.account_2.user_info.student_id })
+
+        etag = response.headers['ETag']
+        response = self.client.get(url_for("api.auth.userinfos"),
+                query_string = query, headers = { 'If-None-Match': etag })
+        self.assertEqual(response.status_code, 304)
+
+        self.login_user(self.account_2)
+        self.post(endpoint = "api.auth.userinfo", data = { 'school': 'New' })
+        response = self.client.get(url_for("api.auth.userinfos"),
+                query_string = query, headers = { 'If-None-Match': etag })
+        self.assertEqual(response.status_code, 200)
+
     @test_context
     def test_user_info_query_others(self):
         response = self.get(
@@ -182,7 +545,428 @@ class AuthTest(ApiTest):
         self.assertEqual(response.status_code, 200)
         self.assertEqual(data['school'], self.account_2.user_info.school)
 
+    @test_context
+    def test_user_info_update_invalidates_cached_user(self):
+        self.login_user(self.account_2)
+        get_school = lambda: self.load_data(self.get(
+                endpoint = "api.auth.userinfo",
+                data = { 'info': ['school'] }
+            ).data)['school']
+
+        self.assertEqual(get_school(), self.account_2.user_info.school)
+
+        hits = get_user_cache().stats()['hits']
+        self.post(
+                endpoint = "api.auth.userinfo",
+                data = { 'school': 'New School' }
+            )
+        self.assertEqual(get_user_cache().stats()['hits'], hits + 1)
+
+        self.assertEqual(get_school(), 'New School')
+
+    @test_context
+    def test_anonymous_request_writes_no_session(self):
+        response = self.get(
+                endpoint = "api.auth.userinfo",
+                data = {
+                    'uid': self.account_2.uid,
+                    'info': ['school'],
+                }
+            )
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.dbsess.query(Session).count(), 0)
+
+    @test_context
+    def test_stateless_signup_skips_session(self):
+        self.login_user(self.account_1)
+        sessions = self.dbsess.query(Session).count()
+
+        with self.assertMaxQueries(4) as statements:
+            response = self.post(
+                    endpoint = "api.auth.account",
+                    data = { 'name': 'forrest' }
+                )
+
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('Set-Cookie', response.headers)
+        self.assertFalse([s for s in statements if 'geek_session' in s])
+        self.assertEqual(self.dbsess.query(Session).count(), sessions)
+
+    @test_context
+    def test_session_loaded_lazily(self):
+        self.login_user(self.account_1)
+        sid = self.dbsess.query(Session).one().sid
+        interface = current_app.session_interface
+
+        with current_app.test_request_context(url_for("api.auth.userinfo"),
+                headers = { 'Cookie':
+                '%s=%s' % (current_app.session_cookie_name, sid) }):
+            with self.assertMaxQueries(0):
+                sess = interface.open_session(current_app, flask_request)
+            self.assertFalse(sess.loaded)
+
+            with self.assertMaxQueries(1):
+                self.assertEqual(sess['user_id'], self.account_1.uid)
+            self.assertTrue(sess.loaded)
+
+    @test_context
+    def test_session_write_behind(self):
+        interface = current_app.session_interface
+        current_app.config["SESSION_WRITE_BEHIND"] = True
+
+        try:
+            self.login_user(self.account_1)
+            self.assertEqual(self.dbsess.query(Session).count(), 0)
+            self.assertEqual(len(interface.pending), 1)
+
+            # buffered sessions are visible before they are flushed
+            self.assertEqual(session["user_id"], self.account_1.uid)
+
+            self.assertEqual(interface.flush(current_app), 1)
+            self.assertEqual(self.dbsess.query(Session).count(), 1)
+        finally:
+            current_app.config["SESSION_WRITE_BEHIND"] = False
+            interface.flusher.stop()
+            interface.flusher = None
+
+    @test_context
+    def test_session_cache(self):
+        interface = current_app.session_interface
+        current_app.config["SESSION_CACHE_SIZE"] = 16
+
+        try:
+            self.login_user(self.account_1)
+            self.dbsess.query(Session).delete()
+            self.dbsess.commit()
+
+            # served from the cache although the row is gone
+            response = self.post(endpoint = "api.auth.logout")
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(interface.cache.stats()['hits'], 1)
+
+            # logging out replaced the cached session
+            response = self.post(endpoint = "api.auth.logout")
+            self.assertEqual(response.status_code, 401)
+        finally:
+            current_app.config["SESSION_CACHE_SIZE"] = 0
+            interface.cache = None
+
+    @test_context
+    def test_legacy_pickled_session(self):
+        self.dbsess.add(Session(
+                sid = 'legacy-session',
+                data = pickle.dumps({ 'user_id': self.account_1.uid }, 2),
+            ))
+        self.dbsess.commit()
+        self.client.set_cookie('localhost',
+                current_app.session_cookie_name, 'legacy-session')
+
+        response = self.post(endpoint = "api.auth.logout")
+        data = self.load_data(response.data)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(data['uid'], self.account_1.uid)
+
+    @test_context
+    def test_reap_expired_sessions(self):
+        now = datetime.utcnow()
+        for i, delta in enumerate([-2, -1, 1]):
+            self.dbsess.add(Session(
+                    sid = 'session-%d' % i,
+                    data = b'',
+                    expiry = now + timedelta(days=delta),
+                ))
+        self.dbsess.commit()
+
+        stats = current_app.session_interface.reap(current_app, batch_size=1)
+
+        self.assertEqual(stats['rows'], 2)
+        self.assertEqual(stats['batches'], 3)
+        self.assertEqual([s.sid for s in self.dbsess.query(Session)],
+                ['session-2'])
+
+    @test_context
+    def test_reap_sessions_without_expiry(self):
+        self.dbsess.add(Session(sid = 'legacy', data = b''))
+        self.dbsess.commit()
+        interface = current_app.session_interface
+
+        stats = interface.reap(current_app)
+        self.assertEqual((stats['backfilled'], stats['rows']), (1, 0))
+
+        stats = interface.reap(current_app, now = datetime.utcnow() +
+                current_app.permanent_session_lifetime + timedelta(days=1))
+        self.assertEqual((stats['backfilled'], stats['rows']), (0, 1))
+
+    @test_context
+    def test_static_files_from_index(self):
+        current_app.config["STATIC_INDEX"] = True
+        try:
+            response = self.client.get('/')
+            etag = response.headers['ETag']
+
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.mimetype, 'text/html')
+            self.assertEqual(response.headers['Cache-Control'], 'no-cache')
+            self.assertNotIn('Set-Cookie', response.headers)
+
+            response = self.client.get('/index.html',
+                    headers = { 'If-None-Match': etag })
+            self.assertEqual(response.status_code, 304)
+
+            self.assertEqual(self.client.get('/missing').status_code, 404)
+        finally:
+            current_app.config["STATIC_INDEX"] = False
+
+    @test_context
+    def test_static_index_precompresses(self):
+        from common.static import StaticIndex
+
+        with tempfile.TemporaryDirectory() as folder:
+            with open(folder + '/app.js', 'w') as f:
+                f.write('var x = 1;\n' * 50)
+            with open(folder + '/big.js', 'w') as f:
+                f.write('var y = 2;\n' * 100)
+
+            index = StaticIndex(folder, memory_limit=1024)
+
+        self.assertIn('gzip', index.files['app.js'].variants)
+        self.assertIsNone(index.files['big.js'].data)
+
+        with current_app.test_request_context(
+                headers = { 'Accept-Encoding': 'gzip' }):
+            response = index.response('app.js', max_age=60, immutable=True)
+        self.assertEqual(response.headers['Content-Encoding'], 'gzip')
+        self.assertEqual(response.headers['Cache-Control'],
+                'public, max-age=60, immutable')
+        self.assertTrue(response.headers['ETag'].endswith('-gzip"'))
+
+    def test_asgi_adapter(self):
+        import asyncio
+        from common.asgi import WsgiToAsgi
+
+        asgi = WsgiToAsgi(current_app._get_current_object(), threads=2)
+
+        def call(method, path, body=b'', headers=[]):
+            messages = []
+            async def receive():
+                return { 'type': 'http.request', 'body': body }
+            async def send(message):
+                messages.append(message)
+
+            asyncio.run(asgi({ 'type': 'http', 'method': method,
+                    'path': path, 'query_string': b'', 'headers': headers },
+                    receive, send))
+            return messages[0]['status'], dict(messages[0]['headers']), \
+                    messages[1]['body']
+
+        try:
+            status, headers, data = call('POST', '/api/auth/login/',
+                    body = ('uid=%s&passwd=%s' % (self.account_1.uid,
+                        self.account_1.passwd)).encode('latin1'),
+                    headers = [(b'content-type',
+                        b'application/x-www-form-urlencoded')])
+            self.assertEqual(status, 200)
+            self.assertEqual(self.load_data(data)['uid'], self.account_1.uid)
+            self.assertIn(b'set-cookie', headers)
+
+            status, _, _ = call('GET', '/api/auth/nothing/')
+            self.assertEqual(status, 404)
+        finally:
+            asgi.executor.shutdown()
+
+    def test_json_encoders(self):
+        from common.representation import encoders, get_encoder
+
+        data = { 'users': { 'uid': { 'school': u'\u4e00\u70b9', 'n': 1 } } }
+        for name in encoders():
+            self.assertEqual(self.load_data(get_encoder(name)(data)), data)
+
+    def test_error_bodies(self):
+        errors = [
+                AtLeastOneOfArguments(['uid', 'name']),
+                CredentialNotFound('name', u'\u4e00"\\'),
+                PasswordIncorrect(),
+                AccountAlreadyExists(),
+                UserInfoNotFound(),
+                UserInfoNotFound("UID is not provided"),
+                TooManyRequests(1.5),
+            ]
+
+        for error in errors:
+            self.assertEqual(self.load_data(error.body), error.data)
+        self.assertIs(PasswordIncorrect().body, PasswordIncorrect().body)
+
+    @test_context
+    def test_error_response(self):
+        response = self.post(
+                endpoint = "api.auth.login",
+                data = { 'name': 'nobody' }
+            )
+
+        self.assertEqual(response.mimetype, 'application/json')
+        self.assertApiError(self.load_data(response.data), CredentialNotFound)
+
+    def test_route_manifest(self):
+        import api
+
+        def rewrite(path, manifest):
+            with open(path, "w") as f:
+                json.dump(manifest, f)
+
+        with tempfile.NamedTemporaryFile(suffix=".json") as f:
+            api.write_manifest(f.name, stamp="v1")
+            self.assertEqual(api.load_manifest(f.name, stamp="v1"),
+                    api.scan_resources())
+
+            with self.assertLogs('api', 'WARNING'):
+                self.assertIsNone(api.load_manifest(f.name, stamp="v2"))
+
+            # a resource removed since, with the stamp matching
+            manifest = json.load(f)
+            manifest['resources'][0]['class'] = 'Removed'
+            rewrite(f.name, manifest)
+            with self.assertLogs('api', 'WARNING'):
+                self.assertIsNone(api.load_manifest(f.name, stamp="v1"))
+
+    @test_context
+    def test_request_metrics(self):
+        response = self.get(
+                endpoint = "api.auth.userinfo",
+                data = {
+                    'uid': self.account_2.uid,
+                    'info': ['school'],
+                }
+            )
+
+        self.assertEqual(response.headers['X-DB-Queries'], '1')
+        self.assertIn('X-DB-Time', response.headers)
+
+        response = self.get(endpoint = "api.debug.metrics")
+        self.assertEqual(response.status_code, 403)
+
+        response = self.get(endpoint = "api.debug.metrics",
+                headers = { 'X-Admin-Token': "test-admin-token" })
+        data = self.load_data(response.data)['endpoints']
+
+        self.assertEqual(response.status_code, 200)
+        self.assertGreater(data['api.auth.userinfo']['queries']['count'], 0)
+
+
+class PoolTest(ApiTest):
+
+    def setUp(self):
+        # don't keep using a connection of the memory database
+        g.db.session.remove()
+
+        self.db_file = tempfile.NamedTemporaryFile(suffix=".db")
+        self.memory_uri = current_app.config["SQLALCHEMY_DATABASE_URI"]
+        current_app.config["SQLALCHEMY_DATABASE_URI"] = \
+                "sqlite:///" + self.db_file.name
+        super(PoolTest, self).setUp()
+
+    def tearDown(self):
+        super(PoolTest, self).tearDown()
+        g.db.session.remove()
+        current_app.config["SQLALCHEMY_DATABASE_URI"] = self.memory_uri
+        self.db_file.close()
+
+    @test_context
+    def test_pool_reused_across_requests(self):
+        for i in range(3):
+            response = self.post(
+                    endpoint = "api.auth.account",
+                    data = { 'name': 'bill%d' % i }
+                )
+            self.assertEqual(response.status_code, 200)
+
+        response = self.get(endpoint = "api.debug.metrics",
+                headers = { 'X-Admin-Token': "test-admin-token" })
+        pool = self.load_data(response.data)['pool']
+
+        self.assertEqual(pool['class'], 'InstrumentedQueuePool')
+        self.assertEqual(pool['connects'], 1)
+
+        # without instrumenting the requests as well
+        current_app.config["INSTRUMENT"] = False
+        try:
+            response = self.get(endpoint = "api.debug.metrics",
+                    headers = { 'X-Admin-Token': "test-admin-token" })
+        finally:
+            current_app.config["INSTRUMENT"] = True
+        data = self.load_data(response.data)
+        self.assertIsNone(data['endpoints'])
+        self.assertIn('checked_out', data['pool'])
+
+
+class ReplicaTest(ApiTest):
+
+    def setUp(self):
+        g.db.session.remove()
+
+        self.db_files = [tempfile.NamedTemporaryFile(suffix=".db")
+                for _ in range(2)]
+        self.memory_uri = current_app.config["SQLALCHEMY_DATABASE_URI"]
+        current_app.config.update({
+                "SQLALCHEMY_DATABASE_URI": "sqlite:///" + self.db_files[0].name,
+                "SQLALCHEMY_BINDS": {
+                    'replica': "sqlite:///" + self.db_files[1].name },
+                "SQLALCHEMY_READ_REPLICAS": ['replica'],
+            })
+        super(ReplicaTest, self).setUp()
+
+        replica = g.db.get_engine(current_app, bind='replica')
+        g.db.Model.metadata.create_all(replica)
+
+        self.account = Account(passwd = "")
+        self.dbsess.add(self.account)
+        self.dbsess.flush()
+        self.dbsess.add(UserInfo(uid = self.account.uid, school = 'Primary'))
+        self.dbsess.commit()
+
+        replica.execute(UserInfo.__table__.insert(),
+                uid = self.account.uid, school = 'Replica')
+
+    def tearDown(self):
+        replica = g.db.get_engine(current_app, bind='replica')
+        g.db.Model.metadata.drop_all(replica)
+        super(ReplicaTest, self).tearDown()
+        g.db.session.remove()
+
+        current_app.config.update({
+                "SQLALCHEMY_DATABASE_URI": self.memory_uri,
+                "SQLALCHEMY_BINDS": None,
+                "SQLALCHEMY_READ_REPLICAS": [],
+            })
+        for f in self.db_files: f.close()
+
+    def get_school(self):
+        response = self.get(
+                endpoint = "api.auth.userinfo",
+                data = { 'uid': self.account.uid, 'info': ['school'] }
+            )
+        g.db.session.remove()
+        return self.load_data(response.data)['school']
+
+    def test_pin_hook_registered_once(self):
+        hooks = current_app.after_request_funcs[None]
+        self.assertEqual(hooks.count(g.db.pin_to_primary), 1)
+
+    @test_context
+    def test_read_your_writes(self):
+        self.assertEqual(self.get_school(), 'Replica')
+
+        # writing the session pins the client to the primary
+        self.login_user(self.account)
+        self.assertEqual(self.get_school(), 'Primary')
+
+        self.client.delete_cookie('localhost', 'primary_until')
+        self.assertEqual(self.get_school(), 'Replica')
+
 
 suite = unittest.TestSuite()
 suite.addTest(unittest.defaultTestLoader.loadTestsFromTestCase(AuthTest))
+suite.addTest(unittest.defaultTestLoader.loadTestsFromTestCase(PoolTest))
+suite.addTest(unittest.defaultTestLoader.loadTestsFromTestCase(ReplicaTest))
 
@@ -1,10 +1,12 @@
-import flask.ext.restful as restful
-import flask.ext.login as login
+import flask_restful as restful
+import flask_login as login
 
-from flask.ext.restful import reqparse
-from flask import g, session
+from flask_restful.reqparse import Argument
+from flask import g, request
 
 import common.models as models
+from common.init import invalidate_user
+from common.utils import arguments, set_version
 from common.error import (
         UserInfoNotFound
     )
@@ -12,15 +14,16 @@ from common.error import (
 class UserInfo(restful.Resource):
     """Get User Infomation."""
 
-    @login.login_required
-    def post(self):
-        parser = reqparse.RequestParser()
-        parser.add_argument('student_id', type=int)
-        parser.add_argument('department', type=str)
-        parser.add_argument('school', type=str)
-        parser.add_argument('introduction', type=str)
-        args = parser.parse_args()
+    user_loading = { 'user_info': 'joined' }
 
+    @login.login_required
+    @arguments(
+        Argument('student_id', type=int),
+        Argument('department', type=str),
+        Argument('school', type=str),
+        Argument('introduction', type=str),
+    )
+    def post(self, args):
         user_info = login.current_user.user_info
         if not user_info:
             user_info = models.UserInfo(uid=login.current_user.uid);
@@ -31,33 +34,59 @@ class UserInfo(restful.Resource):
             setattr(user_info, info, args[info])
 
         g.db.session.commit()
+        invalidate_user(user_info.uid)
 
         return { "uid": user_info.uid }
 
-    def get(self):
-        parser = reqparse.RequestParser()
-        parser.add_argument('uid', type=str)
-        parser.add_argument('info', type=str, action='append', required=True)
-        args = parser.parse_args()
-
+    @classmethod
+    def version_key(cls):
+        uid = request.values.get('uid')
+        if not uid and login.current_user.is_authenticated:
+            uid = login.current_user.uid
+
+        if login.current_user.is_authenticated and \
+                uid == login.current_user.uid:
+            row = login.current_user.user_info
+        else:
+            row = g.db.session.query(
+                    models.UserInfo.version, models.UserInfo.updated_at) \
+                    .filter(models.UserInfo.uid == uid).first()
+
+        # the uid, as a lookup of oneself doesn't name it
+        return ((uid, row.version), row.updated_at) if row else None
+
+    @arguments(
+        Argument('uid', type=str),
+        Argument('info', type=str, action='append', required=True),
+    )
+    def get(self, args):
         if 'uid' not in args or not args['uid']:
             if login.current_user.is_authenticated:
                 args['uid'] = login.current_user.uid
             else:
                 raise UserInfoNotFound("UID is not provided")
 
-        user_info = models.UserInfo.query.get(args['uid'])
-        if not user_info:
+        fields, columns = models.UserInfo.projection(args['info'])
+
+        if login.current_user.is_authenticated and \
+                args['uid'] == login.current_user.uid:
+            # already loaded along with current_user
+            user_info = login.current_user.user_info
+            version = user_info and (user_info.version, user_info.updated_at)
+            row = [getattr(user_info, f) for f in fields] \
+                    if user_info else None
+        else:
+            # the version for the ETag comes along with the columns
+            row = g.db.session.query(models.UserInfo.version,
+                    models.UserInfo.updated_at, *columns) \
+                    .filter(models.UserInfo.uid == args['uid']).first()
+            version, row = (row[:2], row[2:]) if row else (None, None)
+
+        if row is None:
             raise UserInfoNotFound("This user hasn't provided any information")
 
-        result = {}
-
-        for info in args["info"]:
-            if info not in [ 'student_id', 'department',
-                    'school', 'introduction' ]: continue
-            result[info] = getattr(user_info, info)
-
-        return result
+        set_version((args['uid'], version[0]), version[1])
+        return dict(zip(fields, row))
 
 Entry = UserInfo
 
@@ -0,0 +1,41 @@
+import hashlib
+
+import flask_restful as restful
+
+from flask_restful.reqparse import Argument
+from flask import g
+
+import common.models as models
+from common.utils import arguments, not_modified
+
+class UserInfos(restful.Resource):
+    """Get User Infomation of many users at once."""
+
+    chunk_size = 500
+
+    @arguments(
+        Argument('uid', type=str, action='append', required=True),
+        Argument('info', type=str, action='append', required=True),
+    )
+    def get(self, args):
+        uids = sorted(set(args['uid']))
+        fields, columns = models.UserInfo.projection(args['info'])
+
+        # only the requested columns, one IN query per chunk of uids
+        columns = [models.UserInfo.uid, models.UserInfo.version] + columns
+        rows = []
+        for i in range(0, len(uids), self.chunk_size):
+            rows += g.db.session.query(*columns).filter(
+                    models.UserInfo.uid.in_(uids[i:i + self.chunk_size])).all()
+
+        etag = hashlib.md5(repr((fields, uids,
+            sorted((r[0], r[1]) for r in rows))).encode('utf8')).hexdigest()
+        response = not_modified(etag)
+        if response is not None:
+            return response
+
+        users = dict((r[0], dict(zip(fields, r[2:]))) for r in rows)
+
+        return { 'users': users }, 200, { 'ETag': '"%s"' % etag }
+
+Entry = UserInfos
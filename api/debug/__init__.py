@@ -0,0 +1,4 @@
+def get_entries():
+    from common.utils import get_entries
+    return get_entries(__file__, globals())
+
@@ -0,0 +1,30 @@
+import flask_restful as restful
+
+from flask import g, current_app
+
+from common import instrument
+from common.utils import admin_only
+
+class Metrics(restful.Resource):
+    """
+    Statistics of the connection pools, of the primary and of every read
+    replica, and per endpoint histograms of request time, queries and
+    database time when INSTRUMENT is on. Needs the ADMIN_TOKEN.
+    """
+
+    @admin_only
+    def get(self):
+        # the pools are worth watching without instrumenting every request
+        endpoints = None
+        if current_app.config["INSTRUMENT"]:
+            endpoints = instrument.snapshot()
+
+        replicas = current_app.config["SQLALCHEMY_READ_REPLICAS"]
+        return {
+                'endpoints': endpoints,
+                'pool': g.db.pool_stats(),
+                'replica_pools': dict((bind, g.db.pool_stats(bind=bind))
+                    for bind in replicas),
+            }
+
+Entry = Metrics
@@ -0,0 +1,10 @@
+# Micro-benchmarks. Run them with
+#
+#   ./admin.py microbench <name> [--argument value ...]
+#
+# Every module defines run(**kwargs) returning a JSON serializable dict.
+# Arguments arrive as strings from the command line.
+
+def get_benchmarks():
+    from common.utils import find_modules
+    return find_modules(__file__)
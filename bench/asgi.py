@@ -0,0 +1,119 @@
+# The api under the ASGI adapter against plain WSGI calls from as many
+# threads, at high concurrency, on a sqlite file.
+#
+#   ./admin.py microbench asgi --concurrency 200 --requests 5000
+#
+# Both sides call the application in process, so the numbers compare the
+# dispatch overhead and how each copes with many clients; network and HTTP
+# parsing costs are left out.
+
+import asyncio
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlencode
+
+from flask import g, current_app
+
+URI = 'sqlite:////tmp/assoplat-bench-asgi.db'
+
+def populate():
+    from common.models import Account, UserInfo
+
+    account = Account()
+    g.db.session.add(account)
+    g.db.session.flush()
+    g.db.session.add(UserInfo(uid=account.uid, school='Bench School'))
+    g.db.session.commit()
+
+    return account.uid
+
+def percentiles(latencies, seconds):
+    latencies = sorted(latencies)
+    at = lambda q: latencies[int(round(q * (len(latencies) - 1)))] * 1000
+
+    return {
+            'throughput': len(latencies) / seconds,
+            'p50_ms': at(0.50),
+            'p99_ms': at(0.99),
+        }
+
+def run_sync(app, query, concurrency, requests):
+    from werkzeug.test import EnvironBuilder, run_wsgi_app
+
+    def call():
+        environ = EnvironBuilder(path='/api/auth/userinfo/',
+                query_string=query).get_environ()
+        started = time.time()
+        run_wsgi_app(app.wsgi_app, environ, buffered=True)
+        return time.time() - started
+
+    started = time.time()
+    with ThreadPoolExecutor(concurrency) as executor:
+        latencies = list(executor.map(lambda _: call(), range(requests)))
+    return percentiles(latencies, time.time() - started)
+
+def run_asgi(app, query, concurrency, requests, threads):
+    from common.asgi import WsgiToAsgi
+
+    asgi = WsgiToAsgi(app, threads)
+    scope = {
+            'type': 'http',
+            'method': 'GET',
+            'path': '/api/auth/userinfo/',
+            'query_string': query.encode('latin1'),
+            'headers': [],
+        }
+
+    async def call():
+        async def receive():
+            return { 'type': 'http.request', 'body': b'' }
+        async def send(message):
+            pass
+
+        started = time.time()
+        await asgi(scope, receive, send)
+        return time.time() - started
+
+    async def client(n, latencies):
+        for _ in range(n):
+            latencies.append(await call())
+
+    async def main():
+        latencies = []
+        per_client = requests // concurrency
+        await asyncio.gather(*[client(per_client, latencies)
+            for _ in range(concurrency)])
+        return latencies
+
+    started = time.time()
+    latencies = asyncio.run(main())
+    seconds = time.time() - started
+    asgi.executor.shutdown()
+    return percentiles(latencies, seconds)
+
+def run(concurrency=200, requests=5000, threads=0):
+    import common.models
+
+    concurrency, requests = int(concurrency), int(requests)
+    threads = int(threads) or current_app.config["ASGI_THREADS"]
+
+    current_app.config["SQLALCHEMY_ECHO"] = False
+    current_app.config["SQLALCHEMY_DATABASE_URI"] = URI
+    g.db.session.remove()
+    g.db.drop_all()
+    g.db.create_all()
+
+    app = current_app._get_current_object()
+    query = urlencode([('uid', populate()), ('info', 'school')])
+    try:
+        return {
+                'concurrency': concurrency,
+                'requests': requests,
+                'asgi_threads': threads,
+                'sync': run_sync(app, query, concurrency, requests),
+                'asgi': run_asgi(app, query, concurrency, requests, threads),
+            }
+    finally:
+        g.db.session.remove()
+        g.db.drop_all()
@@ -0,0 +1,53 @@
+# Responses per second built by Flask-RESTful's stock output_json and by the
+# representation of every available JSON encoder, on typical API payloads.
+# Debug mode is turned off, output_json would indent otherwise.
+#
+#   ./admin.py microbench encode --number 20000
+
+import timeit
+import uuid
+
+from flask import current_app
+
+def payloads():
+    info = {
+            'student_id': 2013999999,
+            'department': u'一点人生的经验',
+            'school': u'一点微小的工作',
+            'introduction': u'一个上海的书记' * 10,
+        }
+
+    return {
+            'login': { 'uid': str(uuid.uuid4()) },
+            'userinfo': info,
+            'userinfos_100': { 'users': dict((str(uuid.uuid4()), info)
+                for _ in range(100)) },
+            'error': { 'status': { 'code': 3,
+                'message': "Password is incorrect" } },
+        }
+
+def run(number=20000):
+    from flask_restful.representations.json import output_json
+    from common.representation import encoders, get_encoder, representation
+
+    number = int(number)
+    current_app.config["RESTFUL_JSON"] = {}
+
+    outputs = { 'restful_output_json': output_json }
+    for name in encoders():
+        outputs[name] = representation(get_encoder(name))
+
+    result = {}
+    debug, current_app.debug = current_app.debug, False
+    try:
+        with current_app.test_request_context():
+            for payload, data in payloads().items():
+                # each payload runs for about the same time
+                n = max(1, number // max(1, len(str(data)) // 200))
+                result[payload] = dict((name, n / timeit.timeit(
+                    lambda: output(data, 200), number=n))
+                    for name, output in outputs.items())
+    finally:
+        current_app.debug = debug
+
+    return { 'number': number, 'responses_per_sec': result }
@@ -0,0 +1,79 @@
+# Error path: logins with a wrong password, end to end, and the cost of
+# building the error bodies alone, encoded per raise as before against the
+# bodies the error classes carry.
+#
+#   ./admin.py microbench errors --n 2000
+
+import hashlib
+import json
+import time
+import timeit
+
+from flask import g, current_app
+
+def percentile(sorted_values, q):
+    return sorted_values[int(round(q * (len(sorted_values) - 1)))] * 1000
+
+def failed_logins(n):
+    from common.models import Account, Credential
+
+    account = Account(passwd=hashlib.md5(b"right").hexdigest())
+    g.db.session.add(account)
+    g.db.session.flush()
+    g.db.session.add(Credential(cred_type='name', cred_value='victim',
+        uid=account.uid))
+    g.db.session.commit()
+
+    wrong = hashlib.md5(b"wrong").hexdigest()
+    latencies = []
+    with current_app.test_client() as client:
+        for _ in range(n):
+            started = time.time()
+            response = client.post('/api/auth/login/',
+                    data = { 'name': 'victim', 'passwd': wrong })
+            latencies.append(time.time() - started)
+            assert response.status_code == 400, response.data
+
+    latencies.sort()
+    return {
+            'p50_ms': percentile(latencies, 0.50),
+            'p99_ms': percentile(latencies, 0.99),
+            'per_sec': n / sum(latencies),
+        }
+
+def bodies(number):
+    from common.error import PasswordIncorrect, CredentialNotFound
+
+    result = {}
+    for name, make in [
+            ('fixed', PasswordIncorrect),
+            ('templated', lambda: CredentialNotFound('name', 'victim')),
+        ]:
+        result[name] = {
+                'json_dumps_per_sec': number / timeit.timeit(
+                    lambda: json.dumps(make().data).encode('utf8'),
+                    number=number),
+                'body_per_sec': number / timeit.timeit(
+                    lambda: make().body, number=number),
+            }
+    return result
+
+def run(n=2000, number=100000, uri='sqlite://'):
+    import common.models
+
+    current_app.config["SQLALCHEMY_ECHO"] = False
+    current_app.config["SQLALCHEMY_DATABASE_URI"] = uri
+    current_app.config["RATELIMIT_ENABLED"] = False
+    g.db.session.remove()
+    g.db.drop_all()
+    g.db.create_all()
+
+    try:
+        return {
+                'n': int(n),
+                'failed_login': failed_logins(int(n)),
+                'bodies': bodies(int(number)),
+            }
+    finally:
+        g.db.session.remove()
+        g.db.drop_all()
@@ -0,0 +1,205 @@
+# Load test replaying a weighted mix of API calls through the ApiTest
+# plumbing, from several threads at once. Run it with ./admin.py bench.
+#
+# An in-memory sqlite database lives in a single connection, so requests
+# against it are serialized; use the file database to measure concurrency.
+
+import hashlib
+import random
+import subprocess
+import threading
+import time
+
+from flask import g, current_app
+
+from common.utils import ApiTest
+
+DEFAULT_MIX = "login=4,userinfo_get=3,userinfo_post=1,account_create=1,logout=1"
+
+DATABASES = {
+        'memory': 'sqlite://',
+        'file': 'sqlite:////tmp/assoplat-bench-load.db',
+    }
+
+class BenchClient(ApiTest):
+    """Drives the API with one test client, outside of unittest."""
+
+    def __init__(self, worker, lock=None):
+        ApiTest.__init__(self)
+        self.worker = worker
+        self.lock = lock
+        self.counter = 0
+        self.logged_in = False
+        self.client = current_app.test_client()
+        self.login_record = None
+
+    def runTest(self):
+        pass
+
+    def record_requests(self, *args, **kwargs):
+        pass
+
+    def open(self, method, endpoint, **kwargs):
+        if self.lock is None:
+            return ApiTest.open(self, method, endpoint, **kwargs)
+        with self.lock:
+            return ApiTest.open(self, method, endpoint, **kwargs)
+
+    def setup_account(self):
+        self.name = 'bench-%d' % self.worker
+        self.passwd = hashlib.md5(self.name.encode('utf8')).hexdigest()
+        response = self.post(
+                endpoint = "api.auth.account",
+                data = { 'name': self.name, 'passwd': self.passwd }
+            )
+        self.uid = self.load_data(response.data)['uid']
+
+    def ensure_login(self):
+        if not self.logged_in:
+            self.login()
+
+    # Operations; each returns the response of the request to time.
+
+    def login(self):
+        self.logged_in = True
+        return self.post(
+                endpoint = "api.auth.login",
+                data = { 'name': self.name, 'passwd': self.passwd }
+            )
+
+    def userinfo_get(self):
+        return self.get(
+                endpoint = "api.auth.userinfo",
+                data = { 'uid': self.uid, 'info': ['school', 'student_id'] }
+            )
+
+    def userinfo_post(self):
+        self.ensure_login()
+        return self.post(
+                endpoint = "api.auth.userinfo",
+                data = { 'school': 'School %d' % random.randrange(100) }
+            )
+
+    def account_create(self):
+        self.counter += 1
+        return self.post(
+                endpoint = "api.auth.account",
+                data = { 'name': '%s-%d' % (self.name, self.counter) }
+            )
+
+    def logout(self):
+        self.ensure_login()
+        self.logged_in = False
+        return self.post(endpoint = "api.auth.logout")
+
+_query_count = threading.local()
+
+def _count_query(*args):
+    _query_count.value = getattr(_query_count, 'value', 0) + 1
+
+def parse_mix(mix):
+    ops = []
+    for item in mix.split(','):
+        name, weight = item.split('=')
+        ops.append((name.strip(), int(weight)))
+    return ops
+
+def percentile(sorted_values, q):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[int(round(q * (len(sorted_values) - 1)))]
+
+def summarize(samples, seconds):
+    latencies = sorted(s[1] for s in samples)
+    return {
+            'requests': len(samples),
+            'errors': sum(1 for s in samples if s[2] >= 500),
+            'throughput': len(samples) / seconds if seconds else 0.0,
+            'p50_ms': percentile(latencies, 0.50) * 1000,
+            'p95_ms': percentile(latencies, 0.95) * 1000,
+            'p99_ms': percentile(latencies, 0.99) * 1000,
+            'queries_per_request':
+                sum(s[3] for s in samples) / float(len(samples))
+                if samples else 0.0,
+        }
+
+def run_database(uri, concurrency, requests, mix):
+    import common.models
+
+    current_app.config["SQLALCHEMY_DATABASE_URI"] = uri
+    g.db.session.remove()
+    g.db.drop_all()
+    g.db.create_all()
+
+    app = current_app._get_current_object()
+    lock = threading.Lock() if uri == DATABASES['memory'] else None
+    names = [name for name, _ in mix]
+    weights = [weight for _, weight in mix]
+    samples = []
+    samples_lock = threading.Lock()
+
+    def worker(i):
+        with app.test_request_context():
+            client = BenchClient(i, lock)
+            client.setup_account()
+
+            local = []
+            for _ in range(requests):
+                op = random.choices(names, weights)[0]
+                _query_count.value = 0
+                started = time.time()
+                response = getattr(client, op)()
+                local.append((op, time.time() - started,
+                    response.status_code, _query_count.value))
+
+            with samples_lock:
+                samples.extend(local)
+
+    threads = [threading.Thread(target=worker, args=(i,))
+            for i in range(concurrency)]
+    started = time.time()
+    for t in threads: t.start()
+    for t in threads: t.join()
+    seconds = time.time() - started
+
+    g.db.session.remove()
+    g.db.drop_all()
+
+    result = summarize(samples, seconds)
+    result['serialized'] = lock is not None
+    result['operations'] = dict((op, summarize(
+        [s for s in samples if s[0] == op], seconds)) for op in names)
+    return result
+
+def run(db="memory,file", concurrency=4, requests=200, mix=DEFAULT_MIX):
+    from sqlalchemy import event
+    from sqlalchemy.engine import Engine
+    import common.config
+
+    current_app.config.from_object(common.config.ApiTestConfig)
+    current_app.config["SQLALCHEMY_ECHO"] = False
+    current_app.config["INSTRUMENT"] = False
+
+    try:
+        commit = subprocess.check_output(["git", "rev-parse", "HEAD"],
+                stderr=subprocess.STDOUT).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+
+    result = {
+            'commit': commit,
+            'concurrency': int(concurrency),
+            'requests_per_worker': int(requests),
+            'mix': mix,
+            'databases': {},
+        }
+
+    event.listen(Engine, "after_cursor_execute", _count_query)
+    try:
+        for name in db.split(','):
+            result['databases'][name] = run_database(DATABASES[name],
+                    int(concurrency), int(requests), parse_mix(mix))
+    finally:
+        event.remove(Engine, "after_cursor_execute", _count_query)
+
+    return result
@@ -0,0 +1,60 @@
+# Request parsing overhead per endpoint: building the parser on every request,
+# as resources used to, against the parser built once by @arguments.
+
+import hashlib
+import json
+import timeit
+
+from flask import current_app
+
+SAMPLE_REQUESTS = {
+    ('api.auth.login', 'post'): {
+        'data': {
+            'name': 'john',
+            'passwd': hashlib.md5(b"123pass").hexdigest(),
+        },
+    },
+    ('api.auth.account', 'post'): {
+        'data': {
+            'name': 'john',
+            'email': 'john@example.com',
+            'phone': '13800000000',
+            'passwd': hashlib.md5(b"123pass").hexdigest(),
+        },
+    },
+    ('api.auth.accounts', 'post'): {
+        'data': json.dumps({ 'accounts': [{ 'name': 'john' }] }),
+        'content_type': 'application/json',
+    },
+    ('api.auth.userinfo', 'get'): {
+        'query_string': 'uid=x&info=school&info=introduction',
+    },
+    ('api.auth.userinfo', 'post'): {
+        'data': { 'student_id': '2013999999', 'school': 'Computer Science' },
+    },
+}
+
+def run(rounds=5000):
+    from common.utils import view_attribute
+
+    rounds = int(rounds)
+    result = {}
+
+    for (endpoint, method), request in sorted(SAMPLE_REQUESTS.items()):
+        view_class = view_attribute(current_app, endpoint, 'view_class')
+        parser = getattr(view_class, method).parser
+
+        with current_app.test_request_context(
+                method=method.upper(), **request):
+            # copy() rebuilds every argument, like a parser built per request
+            per_request = timeit.timeit(
+                    lambda: parser.copy().parse_args(), number=rounds)
+            precompiled = timeit.timeit(
+                    lambda: parser.parse_args(), number=rounds)
+
+        result["%s %s" % (method.upper(), endpoint)] = {
+                'per_request_us': per_request / rounds * 1e6,
+                'precompiled_us': precompiled / rounds * 1e6,
+            }
+
+    return result
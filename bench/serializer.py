@@ -0,0 +1,42 @@
+# Bytes per row and encode/decode time of each session format.
+
+import hashlib
+import timeit
+import uuid
+
+from common import serializer
+
+def sample_sessions():
+    uid = str(uuid.uuid4())
+    ident = hashlib.sha512(b"127.0.0.1|Mozilla/5.0").hexdigest()
+
+    return {
+            'empty': {},
+            'anonymous': { '_id': ident },
+            'logged_in': { 'user_id': uid, '_fresh': True, '_id': ident },
+            'remembered': { 'user_id': uid, '_fresh': False, '_id': ident,
+                'remember': 'set' },
+        }
+
+def run(rounds=20000):
+    rounds = int(rounds)
+    result = {}
+
+    for sname, sess in sample_sessions().items():
+        result[sname] = {}
+        for fmt in serializer.formats():
+            data = serializer.dumps(sess, fmt)
+            assert serializer.loads(data) == sess
+
+            encode = timeit.timeit(
+                    lambda: serializer.dumps(sess, fmt), number=rounds)
+            decode = timeit.timeit(
+                    lambda: serializer.loads(data), number=rounds)
+
+            result[sname][fmt] = {
+                    'bytes': len(data),
+                    'encode_us': encode / rounds * 1e6,
+                    'decode_us': decode / rounds * 1e6,
+                }
+
+    return result
@@ -0,0 +1,137 @@
+# ASGI entry point. Serve with ./admin.py serve, which needs uvicorn.
+#
+# Flask views stay synchronous: every request runs in a bounded thread pool
+# (ASGI_THREADS) while the event loop only reads request bodies and writes
+# responses, so slow clients don't hold a thread nor a database connection.
+# Keep ASGI_THREADS within SQLALCHEMY_POOL_SIZE + SQLALCHEMY_MAX_OVERFLOW, or
+# threads will queue on the connection pool instead of the executor.
+#
+# Session reads and writes happen in the worker threads along with the rest
+# of the view; with SESSION_WRITE_BEHIND, saving only fills the in-memory
+# buffer and the background flusher does the database work.
+
+import asyncio
+import io
+import sys
+
+from concurrent.futures import ThreadPoolExecutor
+
+class WsgiToAsgi(object):
+    """ASGI application running wsgi_app in a pool of threads."""
+
+    def __init__(self, wsgi_app, threads=20):
+        self.wsgi_app = wsgi_app
+        self.threads = threads
+        self.executor = ThreadPoolExecutor(threads,
+                thread_name_prefix="asgi-worker")
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self.lifespan(receive, send)
+        elif scope['type'] == 'http':
+            await self.http(scope, receive, send)
+        else:
+            raise ValueError("Unsupported ASGI scope %r" % scope['type'])
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({ 'type': 'lifespan.startup.complete' })
+            elif message['type'] == 'lifespan.shutdown':
+                self.executor.shutdown(wait=True)
+                await send({ 'type': 'lifespan.shutdown.complete' })
+                return
+
+    async def http(self, scope, receive, send):
+        body = []
+        while True:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                return
+            body.append(message.get('body', b''))
+            if not message.get('more_body', False):
+                break
+
+        environ = build_environ(scope, b''.join(body))
+        status, headers, chunks = await asyncio.get_running_loop() \
+                .run_in_executor(self.executor, self.run_wsgi, environ)
+
+        await send({
+                'type': 'http.response.start',
+                'status': status,
+                'headers': [(k.lower().encode('latin1'), v.encode('latin1'))
+                    for k, v in headers],
+            })
+        await send({ 'type': 'http.response.body', 'body': b''.join(chunks) })
+
+    def run_wsgi(self, environ):
+        response = []
+        chunks = []
+
+        def start_response(status, headers, exc_info=None):
+            response[:] = [int(status.split(' ', 1)[0]), headers]
+            return chunks.append
+
+        iterable = self.wsgi_app(environ, start_response)
+        try:
+            chunks.extend(iterable)
+        finally:
+            if hasattr(iterable, 'close'):
+                iterable.close()
+
+        return response[0], response[1], chunks
+
+def build_environ(scope, body):
+    root_path = scope.get('root_path', '')
+    path = scope['path']
+    if path.startswith(root_path):
+        path = path[len(root_path):]
+
+    server = scope.get('server') or ('localhost', 80)
+    client = scope.get('client') or ('', 0)
+
+    environ = {
+            'REQUEST_METHOD': scope['method'],
+            # WSGI carries the undecoded bytes of the path as latin-1
+            'SCRIPT_NAME': root_path.encode('utf8').decode('latin1'),
+            'PATH_INFO': path.encode('utf8').decode('latin1'),
+            'QUERY_STRING': scope.get('query_string', b'').decode('latin1'),
+            'SERVER_NAME': server[0],
+            'SERVER_PORT': str(server[1]),
+            'SERVER_PROTOCOL': 'HTTP/%s' % scope.get('http_version', '1.1'),
+            'REMOTE_ADDR': client[0],
+            'CONTENT_LENGTH': str(len(body)),
+            'wsgi.version': (1, 0),
+            'wsgi.url_scheme': scope.get('scheme', 'http'),
+            'wsgi.input': io.BytesIO(body),
+            'wsgi.errors': sys.stderr,
+            'wsgi.multithread': True,
+            'wsgi.multiprocess': True,
+            'wsgi.run_once': False,
+        }
+
+    for name, value in scope.get('headers', []):
+        name = name.decode('latin1').upper().replace('-', '_')
+        value = value.decode('latin1')
+        if name == 'CONTENT_LENGTH':
+            continue
+        if name != 'CONTENT_TYPE':
+            name = 'HTTP_' + name
+
+        if name in environ:
+            value = environ[name] + ('; ' if name == 'HTTP_COOKIE' else ',') \
+                    + value
+        environ[name] = value
+
+    return environ
+
+def create_app(threads=None):
+    """Initialize the Flask application and wrap it for ASGI servers."""
+    from . import init
+
+    app = init.get_app()
+    with app.app_context():
+        init.init_everything()
+
+    return WsgiToAsgi(app, threads or app.config["ASGI_THREADS"])
@@ -0,0 +1,39 @@
+# Bloom filter. DO NOT IMPORT FLASK BASED LIBRARIES IN THIS FILE
+
+import hashlib
+import math
+import threading
+
+class BloomFilter(object):
+    """
+    Set membership with false positives at about error_rate once capacity
+    keys have been added, and no false negatives. Lookups take no lock.
+    """
+
+    def __init__(self, capacity, error_rate=0.01):
+        capacity = max(1, capacity)
+        self.size = int(math.ceil(
+                -capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, int(round(self.size / capacity * math.log(2))))
+        self.count = 0
+
+        self._bits = bytearray((self.size + 7) // 8)
+        self._lock = threading.Lock()
+
+    def _positions(self, key):
+        digest = hashlib.blake2b(key.encode('utf8'), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return [(h1 + i * h2) % self.size for i in range(self.hashes)]
+
+    def add(self, key):
+        positions = self._positions(key)
+        with self._lock:
+            for p in positions:
+                self._bits[p >> 3] |= 1 << (p & 7)
+            self.count += 1
+
+    def __contains__(self, key):
+        bits = self._bits
+        return all(bits[p >> 3] & (1 << (p & 7))
+                for p in self._positions(key))
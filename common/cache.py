@@ -0,0 +1,104 @@
+# In-process caches. DO NOT IMPORT FLASK BASED LIBRARIES IN THIS FILE
+
+import hashlib
+import hmac
+import os
+import threading
+import time
+
+from collections import OrderedDict
+
+class LRUCache(object):
+    """
+    Thread safe mapping bounded by size, evicting the least recently used
+    entry. Each entry expires after ttl seconds, or earlier if a shorter ttl
+    is given to set().
+    """
+
+    def __init__(self, size, ttl=None):
+        self.size = size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+
+            value, expires = entry
+            if expires is not None and expires <= time.time():
+                del self._data[key]
+                self.misses += 1
+                return default
+
+            # mark as most recently used
+            del self._data[key]
+            self._data[key] = entry
+            self.hits += 1
+            return value
+
+    def set(self, key, value, ttl=None):
+        if self.ttl is not None:
+            ttl = self.ttl if ttl is None else min(ttl, self.ttl)
+        if ttl is not None and ttl <= 0:
+            self.invalidate(key)
+            return
+
+        expires = time.time() + ttl if ttl is not None else None
+
+        with self._lock:
+            self._data.pop(key, None)
+            self._data[key] = (value, expires)
+            while len(self._data) > self.size:
+                self._data.popitem(last=False)
+
+    def invalidate(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self):
+        return {
+                'size': len(self._data),
+                'capacity': self.size,
+                'hits': self.hits,
+                'misses': self.misses,
+            }
+
+class PasswordCache(object):
+    """
+    Passwords verified recently, by uid. Only a digest of each password hash,
+    keyed with a secret of this process, is kept; comparisons take constant
+    time.
+    """
+
+    def __init__(self, size, ttl=None):
+        self.cache = LRUCache(size, ttl)
+        self._key = os.urandom(32)
+
+    def digest(self, passwd):
+        return hmac.new(self._key, (passwd or "").lower().encode('utf8'),
+                hashlib.sha256).digest()
+
+    def verify(self, uid, passwd):
+        cached = self.cache.get(uid)
+        return cached is not None and \
+                hmac.compare_digest(cached, self.digest(passwd))
+
+    def remember(self, uid, passwd):
+        self.cache.set(uid, self.digest(passwd))
+
+    def invalidate(self, uid):
+        self.cache.invalidate(uid)
@@ -0,0 +1,174 @@
+import contextlib
+import threading
+import time
+
+from flask import request, has_request_context
+from flask_sqlalchemy import SQLAlchemy, SignallingSession
+from sqlalchemy.pool import QueuePool
+
+class InstrumentedQueuePool(QueuePool):
+    """QueuePool counting new connections and the time spent waiting."""
+
+    def __init__(self, *args, **kwargs):
+        QueuePool.__init__(self, *args, **kwargs)
+        self.stats_lock = threading.Lock()
+        self.connects = 0
+        self.waits = 0
+        self.wait_time = 0.0
+        self.max_wait_time = 0.0
+
+    def _create_connection(self):
+        with self.stats_lock:
+            self.connects += 1
+        return QueuePool._create_connection(self)
+
+    def _do_get(self):
+        started = time.time()
+        try:
+            return QueuePool._do_get(self)
+        finally:
+            waited = time.time() - started
+            with self.stats_lock:
+                self.waits += 1
+                self.wait_time += waited
+                self.max_wait_time = max(self.max_wait_time, waited)
+
+_QUEUE_POOL_OPTIONS = ['pool_size', 'max_overflow', 'pool_timeout']
+
+_READ_ONLY_METHODS = ('GET', 'HEAD', 'OPTIONS')
+_REPLICA_KEY = 'assoplat.replica'
+_PIN_COOKIE = 'primary_until'
+_WROTE_KEY = 'assoplat.wrote'
+
+class RoutingSession(SignallingSession):
+    """
+    Session sending the queries of read-only requests to a read replica,
+    unless the client has written recently. Flushes always go to the primary.
+    """
+
+    def __init__(self, db, **options):
+        SignallingSession.__init__(self, db, **options)
+        self.db = db
+        self.force_primary = False
+
+    def get_bind(self, mapper=None, clause=None):
+        if self._flushing:
+            mark_write()
+        elif not self.force_primary:
+            replica = self.db.replica_for_request(self.app)
+            if replica is not None:
+                return replica
+
+        return SignallingSession.get_bind(self, mapper, clause)
+
+def mark_write():
+    """Pin the client of the current request to the primary for a while."""
+    if has_request_context():
+        # False until pin_to_primary has set the cookie
+        request.environ.setdefault(_WROTE_KEY, False)
+
+def read_only_request():
+    return has_request_context() and request.method in _READ_ONLY_METHODS \
+            and _WROTE_KEY not in request.environ
+
+class Database(SQLAlchemy):
+    """
+    SQLAlchemy with first-class pool settings: every queue pool reports its
+    statistics (see pool_stats), SQLALCHEMY_POOL_PRE_PING checks connections
+    before handing them out, and sqlite files get a real pool instead of
+    reconnecting for every session.
+
+    Read-only requests are routed to the binds named in
+    SQLALCHEMY_READ_REPLICAS, round-robin. A client which wrote gets a cookie
+    keeping it on the primary for SQLALCHEMY_REPLICA_PIN_SECONDS, so that it
+    reads its own writes.
+    """
+
+    def __init__(self, *args, **kwargs):
+        self._replica_counter = 0
+        SQLAlchemy.__init__(self, *args, **kwargs)
+
+    def init_app(self, app):
+        SQLAlchemy.init_app(self, app)
+        app.after_request(self.pin_to_primary)
+
+    def create_session(self, options):
+        return RoutingSession(self, **options)
+
+    @contextlib.contextmanager
+    def primary(self):
+        """Send the queries of the current session to the primary."""
+        session = self.session()
+        forced, session.force_primary = session.force_primary, True
+        try:
+            yield
+        finally:
+            session.force_primary = forced
+
+    def replica_for_request(self, app):
+        replicas = app.config['SQLALCHEMY_READ_REPLICAS']
+        if not replicas or not read_only_request():
+            return None
+
+        try:
+            if float(request.cookies.get(_PIN_COOKIE, 0)) > time.time():
+                return None
+        except ValueError:
+            pass
+
+        # stick to one replica for the whole request
+        bind = request.environ.get(_REPLICA_KEY)
+        if bind is None:
+            self._replica_counter += 1
+            bind = replicas[self._replica_counter % len(replicas)]
+            request.environ[_REPLICA_KEY] = bind
+
+        return self.get_engine(app, bind=bind)
+
+    def pin_to_primary(self, response):
+        # the value turns True once the cookie is set
+        if has_request_context() and request.environ.get(_WROTE_KEY) is False \
+                and self.get_app().config['SQLALCHEMY_READ_REPLICAS']:
+            seconds = self.get_app().config['SQLALCHEMY_REPLICA_PIN_SECONDS']
+            response.set_cookie(_PIN_COOKIE, str(time.time() + seconds),
+                    max_age=seconds, httponly=True)
+            request.environ[_WROTE_KEY] = True
+        return response
+
+    def apply_driver_hacks(self, app, info, options):
+        SQLAlchemy.apply_driver_hacks(self, app, info, options)
+
+        if info.drivername == 'sqlite' and 'poolclass' not in options:
+            options.setdefault('connect_args', {})['check_same_thread'] = False
+
+        poolclass = options.setdefault('poolclass', InstrumentedQueuePool)
+        if poolclass is QueuePool:
+            options['poolclass'] = InstrumentedQueuePool
+        elif not issubclass(poolclass, QueuePool):
+            # e.g. StaticPool for in-memory sqlite
+            for key in _QUEUE_POOL_OPTIONS:
+                options.pop(key, None)
+
+        if app.config["SQLALCHEMY_POOL_PRE_PING"]:
+            options['pool_pre_ping'] = True
+
+    def pool_stats(self, app=None, bind=None):
+        pool = self.get_engine(app or self.get_app(), bind).pool
+        stats = { 'class': type(pool).__name__ }
+
+        if isinstance(pool, QueuePool):
+            stats.update({
+                    'size': pool.size(),
+                    'checked_in': pool.checkedin(),
+                    'checked_out': pool.checkedout(),
+                    'overflow': pool.overflow(),
+                })
+        if isinstance(pool, InstrumentedQueuePool):
+            stats.update({
+                    'connects': pool.connects,
+                    'waits': pool.waits,
+                    'wait_time': pool.wait_time,
+                    'max_wait_time': pool.max_wait_time,
+                })
+
+        return stats
@@ -1,12 +1,42 @@
 # We define exception classes here. When there is an error you want to handle,
 # add an exception here without hesitation.
 
+import json
+import math
+
 class ApiError(Exception):
+    """
+    Errors answered with their status_code and the JSON body
+
+        {"status": {"code": error_code, "message": message}}
+
+    The body is encoded once, when the class is defined, for errors keeping
+    the message of their class. Other messages only have their own JSON
+    string encoded, between the bytes the class prepared.
+    """
+
     error_code = 0
+    status_code = 400
+    headers = {}
     message = ""
 
-    def __init__(self, message=""):
-        self.message = message
+    def __init__(self, message=None):
+        if message is not None:
+            self.message = message
+
+    def __init_subclass__(cls, **kwargs):
+        super(ApiError, cls).__init_subclass__(**kwargs)
+        cls._prepare()
+
+    @classmethod
+    def _prepare(cls):
+        cls._body_prefix = ('{"status":{"code":%d,"message":' %
+                cls.error_code).encode('utf8')
+        cls._body = cls._encode(cls.message)
+
+    @classmethod
+    def _encode(cls, message):
+        return cls._body_prefix + json.dumps(message).encode('utf8') + b'}}'
 
     @property
     def data(self):
@@ -17,6 +47,14 @@ class ApiError(Exception):
                 }
             }
 
+    @property
+    def body(self):
+        if self.message is type(self).message:
+            return self._body
+        return self._encode(self.message)
+
+ApiError._prepare()
+
 ################################################################################
 # Define Exceptions Here
 
@@ -36,20 +74,35 @@ class CredentialNotFound(ApiError):
 
 class PasswordIncorrect(ApiError):
     error_code = 3
-
-    def __init__(self):
-        self.message = "Password is incorrect"
+    message = "Password is incorrect"
 
 class AccountAlreadyExists(ApiError):
     error_code = 4
-
-    def __init__(self):
-        self.message = "Account information is duplicated"
+    message = "Account information is duplicated"
 
 class UserInfoNotFound(ApiError):
     error_code = 5
+    message = "User info can't be found"
 
     def __init__(self, reason=""):
-        self.message = "User info can't be found"
-        if reason: self.message += ": " + reason
+        if reason: self.message = self.message + ": " + reason
+
+class TooManyRequests(ApiError):
+    error_code = 6
+    status_code = 429
+
+    def __init__(self, retry_after):
+        seconds = int(math.ceil(retry_after))
+        self.message = "Too many requests, retry in {} seconds".format(seconds)
+        self.headers = { 'Retry-After': str(seconds) }
+
+class AdminTokenRequired(ApiError):
+    error_code = 7
+    status_code = 403
+    message = "A valid admin token is required"
+
+class BatchTooLarge(ApiError):
+    error_code = 8
 
+    def __init__(self, limit):
+        self.message = 'At most {} rows are accepted at once'.format(limit)
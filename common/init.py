@@ -3,8 +3,14 @@
 _app = None
 _db = None
 _login_manager = None
+_user_cache = None
+_passwd_cache = None
+_credential_filter = None
+_static_index = None
 
 from flask import current_app
+from sqlalchemy import event
+from sqlalchemy.orm import Session
 
 def get_app():
     global _app
@@ -22,10 +28,10 @@ def get_db():
     global _db
 
     if not _db:
-        from flask.ext.sqlalchemy import SQLAlchemy
+        from .database import Database
 
-        _db = SQLAlchemy(current_app)
-        _db.init_app(current_app)
+        # registers itself, and its after_request hook, with the app
+        _db = Database(current_app)
 
     return _db
 
@@ -33,13 +39,145 @@ def get_login_manager():
     global _login_manager
 
     if not _login_manager:
-        from flask.ext.login import LoginManager
-
-        _login_manager = LoginManager()
+        from flask import session
+        from flask_login import LoginManager
+
+        class SessionLoginManager(LoginManager):
+            def _update_remember_cookie(self, response):
+                # 'remember' is only ever set by a view which loaded the
+                # session, don't fetch it just to look
+                if not getattr(session, 'loaded', True):
+                    return response
+                return LoginManager._update_remember_cookie(self, response)
+
+        _login_manager = SessionLoginManager()
         _login_manager.init_app(current_app)
 
     return _login_manager
 
+def get_user_cache():
+    global _user_cache
+
+    if _user_cache is None and current_app.config["USER_CACHE_SIZE"]:
+        from .cache import LRUCache
+
+        _user_cache = LRUCache(current_app.config["USER_CACHE_SIZE"],
+                ttl=current_app.config["USER_CACHE_TTL"])
+
+    return _user_cache
+
+def invalidate_user(uid):
+    cache = get_user_cache()
+    if cache is not None:
+        cache.invalidate(uid)
+
+def get_passwd_cache():
+    global _passwd_cache
+
+    if _passwd_cache is None and current_app.config["PASSWD_CACHE_SIZE"]:
+        from .cache import PasswordCache
+
+        _passwd_cache = PasswordCache(
+                current_app.config["PASSWD_CACHE_SIZE"],
+                ttl=current_app.config["PASSWD_CACHE_TTL"])
+
+    return _passwd_cache
+
+# Accounts whose password changes or which are deleted are forgotten by the
+# password cache once the transaction commits: forgetting them earlier would
+# let a concurrent login cache the old password again in the meantime. The
+# listeners are registered once and look the cache up when they fire.
+
+_PASSWD_CHANGED_KEY = 'assoplat.passwd_changed'
+
+def _record_passwd_changes(session, flush_context):
+    from sqlalchemy import inspect
+    from .models import Account
+
+    if _passwd_cache is None:
+        return
+
+    uids = set(o.uid for o in session.deleted if isinstance(o, Account))
+    uids.update(o.uid for o in session.dirty if isinstance(o, Account) and
+            inspect(o).attrs.passwd.history.has_changes())
+    if uids:
+        session.info.setdefault(_PASSWD_CHANGED_KEY, set()).update(uids)
+
+def _forget_passwd_changes(session):
+    uids = session.info.pop(_PASSWD_CHANGED_KEY, ())
+    if _passwd_cache is not None:
+        for uid in uids:
+            _passwd_cache.invalidate(uid)
+
+def _drop_passwd_changes(session, previous_transaction):
+    # the changes of a rolled back savepoint may have been recorded along
+    # with ones the outer transaction keeps
+    if previous_transaction.parent is None:
+        session.info.pop(_PASSWD_CHANGED_KEY, None)
+
+event.listen(Session, 'after_flush', _record_passwd_changes)
+event.listen(Session, 'after_commit', _forget_passwd_changes)
+event.listen(Session, 'after_soft_rollback', _drop_passwd_changes)
+
+def credential_key(cred_type, cred_value):
+    """
+    Key of a credential in the credential filter, None for values which
+    aren't strings and never get one.
+    """
+    if not isinstance(cred_value, str):
+        return None
+    # lowercase: a collation ignoring case only makes more keys look taken
+    return u'%s:%s' % (cred_type, cred_value.lower())
+
+def get_credential_filter():
+    """
+    Bloom filter of the credentials in the table, fed with the credentials
+    this process creates. None until warm_credential_filter has built it.
+    """
+    return _credential_filter
+
+def warm_credential_filter():
+    """
+    Build the credential filter from the whole credential table and put it
+    in place of the current one.
+    """
+    global _credential_filter
+
+    if not current_app.config["CREDENTIAL_FILTER_CAPACITY"]:
+        return None
+
+    from sqlalchemy import select, func
+    from .bloom import BloomFilter
+    from .models import Credential
+
+    table = Credential.__table__
+    with get_db().engine.connect() as conn:
+        count = conn.scalar(select([func.count()]).select_from(table))
+        bloom = BloomFilter(max(count * 2,
+                current_app.config["CREDENTIAL_FILTER_CAPACITY"]),
+                current_app.config["CREDENTIAL_FILTER_ERROR_RATE"])
+
+        rows = conn.execution_options(stream_results=True).execute(
+                select([table.c.cred_type, table.c.cred_value]))
+        for cred_type, cred_value in rows:
+            key = credential_key(cred_type, cred_value)
+            if key is not None:
+                bloom.add(key)
+
+    _credential_filter = bloom
+    return bloom
+
+def get_static_index():
+    global _static_index
+
+    if _static_index is None:
+        from .static import StaticIndex
+
+        _static_index = StaticIndex(current_app.static_folder,
+                current_app.config["STATIC_MEMORY_LIMIT"])
+
+    return _static_index
+
 ################################################################################
 # Initialization Items
 
@@ -55,34 +193,86 @@ def init_session_interface():
     from .utils import DatabaseSessionInterface
     from .models import Session
 
-    current_app.session_interface = DatabaseSessionInterface(get_db(), Session)
+    interface = DatabaseSessionInterface(get_db(), Session)
+    current_app.session_interface = interface
+
+    interval = current_app.config["SESSION_REAP_INTERVAL"]
+    if interval:
+        import logging
+        from .utils import PeriodicThread
+
+        app = current_app._get_current_object()
+        batch_size = current_app.config["SESSION_REAP_BATCH"]
+
+        def reap():
+            logging.getLogger(__name__).info("Reaped sessions: %r",
+                    interface.reap(app, batch_size))
+
+        PeriodicThread(interval, reap, name="session-reaper").start()
 
 def init_user_loader():
+    from flask import request
+    from sqlalchemy import inspect
     from .models import Account
+    from .utils import detached_copy, load_options, view_attribute
 
     _lm = get_login_manager()
 
     @_lm.user_loader
     def load_user(uid):
-        return get_db().session.query(Account).get(uid)
+        session = get_db().session
+        cache = get_user_cache()
+
+        # resources tell which relationships of current_user they read
+        loading = view_attribute(current_app, request.endpoint,
+                'user_loading', {})
+        eager = [rel for rel, strategy in loading.items()
+                if strategy not in ('lazy', 'noload')]
+
+        snapshot = cache.get(uid) if cache is not None else None
+        if snapshot is not None and \
+                all(rel in inspect(snapshot).dict for rel in eager):
+            # attach a copy of the snapshot without touching the database
+            return session.merge(snapshot, load=False)
+
+        account = session.query(Account) \
+                .options(*load_options(Account, loading)).get(uid)
+        if account is not None and cache is not None:
+            cache.set(uid, detached_copy(account, "user_info"))
+
+        return account
 
 def init_app():
     # we still need those global varibales during request
     import os
     import api
-    import json
     import mimetypes
     import common.error
+    from flask import request
+    from .utils import view_attribute
+
+    @current_app.before_request
+    def before_request():
+        if view_attribute(current_app, request.endpoint, 'globals', True):
+            init_global_variables()
 
-    current_app.before_request(init_global_variables)
+    from .instrument import init_instrument
+    init_instrument(current_app)
 
     @current_app.errorhandler(common.error.ApiError)
     def error_handler(error):
-        return json.dumps(error.data), 400
+        # errors come with their body encoded
+        return current_app.response_class(error.body, error.status_code,
+                error.headers, mimetype='application/json')
 
     @current_app.route('/', defaults={'filename': 'index'})
     @current_app.route('/<filename>')
     def send_static_files(filename):
+        if current_app.config["STATIC_INDEX"]:
+            return get_static_index().response(filename,
+                    max_age = current_app.config["STATIC_MAX_AGE"],
+                    immutable = current_app.config["STATIC_IMMUTABLE"])
+
         if not os.path.splitext(filename)[1]:
             filename += ".html"
 
@@ -91,6 +281,27 @@ def init_app():
 
         return resp
 
+    # no session, no globals
+    send_static_files.stateless = True
+    send_static_files.globals = False
+
+    if current_app.config["STATIC_INDEX"]:
+        get_static_index() # index at startup rather than on the first hit
+
+    interval = current_app.config["CREDENTIAL_FILTER_REBUILD_INTERVAL"]
+    if current_app.config["CREDENTIAL_FILTER_CAPACITY"] and interval:
+        from .utils import PeriodicThread
+
+        app = current_app._get_current_object()
+
+        def rebuild():
+            with app.app_context():
+                warm_credential_filter()
+
+        # off the requests, which check credentials exactly until it's built
+        PeriodicThread(interval, rebuild, name="credential-filter",
+                delay=0).start()
+
     current_app.register_blueprint(api.get_blueprint(), url_prefix="/api")
 
 ################################################################################
@@ -0,0 +1,151 @@
+# Per request SQL and session timing, enabled with INSTRUMENT = True.
+#
+# Every request counts its queries, the time spent in the database, in loading
+# and saving the session and in serializing the response. In debug mode those
+# numbers are sent back as X-* headers (the session save happens after the
+# headers are out, so only the histograms include it). Each endpoint
+# aggregates them into histograms, see snapshot().
+
+import contextlib
+import threading
+import time
+
+from flask import current_app, has_request_context, request
+
+_ENVIRON_KEY = 'assoplat.metrics'
+
+class RequestMetrics(object):
+    fields = ['total', 'queries', 'db_time', 'session_load', 'session_save',
+            'serialize']
+
+    def __init__(self):
+        self.started = time.time()
+        self.queries = 0
+        self.db_time = 0.0
+        self.session_load = 0.0
+        self.session_save = 0.0
+        self.serialize = 0.0
+
+    @property
+    def total(self):
+        return time.time() - self.started
+
+def current_metrics():
+    if not has_request_context() or not current_app.config["INSTRUMENT"]:
+        return None
+
+    metrics = request.environ.get(_ENVIRON_KEY)
+    if metrics is None:
+        metrics = request.environ[_ENVIRON_KEY] = RequestMetrics()
+    return metrics
+
+@contextlib.contextmanager
+def timed(field):
+    metrics = current_metrics()
+    started = time.time()
+    try:
+        yield
+    finally:
+        if metrics is not None:
+            setattr(metrics, field,
+                    getattr(metrics, field) + time.time() - started)
+
+def timed_representation(func):
+    def wrapper(*args, **kwargs):
+        with timed('serialize'):
+            return func(*args, **kwargs)
+    return wrapper
+
+################################################################################
+# Histograms
+
+class Histogram(object):
+    # upper bounds of the buckets; times are in milliseconds
+    bounds = [1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000]
+
+    def __init__(self):
+        self.count = 0
+        self.sum = 0.0
+        self.buckets = [0] * (len(self.bounds) + 1)
+
+    def add(self, value):
+        i = 0
+        while i < len(self.bounds) and value > self.bounds[i]:
+            i += 1
+        self.buckets[i] += 1
+        self.count += 1
+        self.sum += value
+
+    def as_dict(self):
+        return {
+                'count': self.count,
+                'mean': self.sum / self.count if self.count else 0.0,
+                'buckets': dict(zip([str(b) for b in self.bounds] + ['inf'],
+                    self.buckets)),
+            }
+
+_histograms = {}
+_histograms_lock = threading.Lock()
+
+def record(endpoint, metrics):
+    with _histograms_lock:
+        hists = _histograms.get(endpoint)
+        if hists is None:
+            hists = _histograms[endpoint] = dict(
+                    (f, Histogram()) for f in RequestMetrics.fields)
+
+        for f in RequestMetrics.fields:
+            value = getattr(metrics, f)
+            hists[f].add(value if f == 'queries' else value * 1000)
+
+def snapshot():
+    with _histograms_lock:
+        return dict((endpoint, dict((f, h.as_dict()) for f, h in hists.items()))
+                for endpoint, hists in _histograms.items())
+
+def reset():
+    with _histograms_lock:
+        _histograms.clear()
+
+################################################################################
+# Hooks
+
+_TIME_HEADERS = [
+        ('X-DB-Time', 'db_time'),
+        ('X-Session-Load-Time', 'session_load'),
+        ('X-Serialize-Time', 'serialize'),
+    ]
+
+def _before_cursor_execute(conn, cursor, statement, params, context, many):
+    context._query_started = time.time()
+
+def _after_cursor_execute(conn, cursor, statement, params, context, many):
+    metrics = current_metrics()
+    if metrics is not None:
+        metrics.queries += 1
+        metrics.db_time += time.time() - context._query_started
+
+def init_instrument(app):
+    from sqlalchemy import event
+    from sqlalchemy.engine import Engine
+
+    if not event.contains(Engine, "before_cursor_execute",
+            _before_cursor_execute):
+        event.listen(Engine, "before_cursor_execute", _before_cursor_execute)
+        event.listen(Engine, "after_cursor_execute", _after_cursor_execute)
+
+    @app.after_request
+    def add_metrics_headers(response):
+        metrics = current_metrics()
+        if metrics is not None and current_app.debug:
+            response.headers['X-DB-Queries'] = str(metrics.queries)
+            for header, field in _TIME_HEADERS:
+                response.headers[header] = \
+                        '%.3fms' % (getattr(metrics, field) * 1000)
+        return response
+
+    @app.teardown_request
+    def record_metrics(exc):
+        metrics = current_metrics()
+        if metrics is not None:
+            record(request.endpoint or '<unmatched>', metrics)
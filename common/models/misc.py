@@ -11,5 +11,5 @@ class Session(db.Model):
     sid = db.Column(db.String(36), primary_key=True,
             default=lambda: str(uuid.uuid4()))
     data = db.Column(db.LargeBinary)
-    expiry = db.Column(db.DateTime)
+    expiry = db.Column(db.DateTime, index=True)
 
@@ -12,6 +12,8 @@ class Account(db.Model):
             default=lambda: str(uuid.uuid4()))
     passwd = db.Column(db.String(32), default="")
     created_at = db.Column(db.DateTime, default=datetime.datetime.now)
+    updated_at = db.Column(db.DateTime, default=datetime.datetime.utcnow,
+            onupdate=datetime.datetime.utcnow)
 
     credentials = db.relationship("Credential", back_populates="account")
     user_info = db.relationship("UserInfo",
@@ -40,7 +42,7 @@ class Credential(db.Model):
 
     cred_type = db.Column(db.Enum("email", "phone", "name"))
     cred_value = db.Column(db.String(64))
-    uid = db.Column(db.String(36), db.ForeignKey(Account.uid))
+    uid = db.Column(db.String(36), db.ForeignKey(Account.uid), index=True)
 
     account = db.relationship(Account,
             back_populates="credentials", uselist=False)
@@ -52,10 +54,34 @@ class UserInfo(db.Model):
     student_id = db.Column(db.Integer)
     department = db.Column(db.String(128))
     school = db.Column(db.String(128))
-    introduction = db.Column(db.Text)
+    # unbounded, only loaded when asked for
+    introduction = db.deferred(db.Column(db.Text))
+    # bumped by every UPDATE, identifies the state of the row in ETags
+    version = db.Column(db.Integer, nullable=False, default=1,
+            server_default='1', onupdate=db.literal_column('version + 1'))
+    updated_at = db.Column(db.DateTime, default=datetime.datetime.utcnow,
+            onupdate=datetime.datetime.utcnow)
 
     account = db.relationship(Account,
             back_populates="user_info", uselist=False)
 
+    # columns clients can't ask for
+    private_fields = ('uid', 'version', 'updated_at')
+
+    @classmethod
+    def info_fields(cls):
+        if '_info_fields' not in cls.__dict__:
+            from sqlalchemy import inspect
+            cls._info_fields = [attr.key
+                    for attr in inspect(cls).column_attrs
+                    if attr.key not in cls.private_fields]
+        return cls._info_fields
+
+    @classmethod
+    def projection(cls, fields):
+        """Allowed fields out of the requested ones, and their columns."""
+        fields = [f for f in cls.info_fields() if f in fields]
+        return fields, [getattr(cls, f) for f in fields]
+
 
 
@@ -0,0 +1,150 @@
+# Token bucket rate limiting, enabled with RATELIMIT_ENABLED.
+#
+# Resources declare their limits per method:
+#
+#   class Login(restful.Resource):
+#       rate_limits = {
+#           'POST': [Limit('ip', 60, 60), Limit('credential', 10, 60)],
+#       }
+#
+# Limit(key, count, period) lets count requests through every period seconds
+# for each value of key, in bursts of up to count. Keys are read from the raw
+# request (see KEYS), so rejected requests are neither parsed nor do they
+# reach the database. Buckets are separate for every endpoint.
+#
+# Behind reverse proxies the peer of a request is the nearest proxy, so 'ip'
+# would put every client in one bucket. Set RATELIMIT_TRUSTED_PROXIES to the
+# number of proxies in front of the app to read the client from
+# X-Forwarded-For instead. Entries left of those the proxies appended are
+# sent by the client and never trusted.
+#
+# Buckets live in the process (LocalBackend) unless RATELIMIT_BACKEND names
+# a "module:factory" building a shared backend from the app. A backend only
+# needs consume(key, count, period), returning 0 when the request may go on,
+# else the seconds until it would.
+
+import collections
+import functools
+import threading
+import time
+
+from flask import current_app, request
+
+from .error import TooManyRequests
+
+Limit = collections.namedtuple('Limit', ['key', 'count', 'period'])
+
+def _credential():
+    # same precedence as Login.post
+    for cred_type in ('name', 'email', 'phone'):
+        value = request.values.get(cred_type)
+        if value:
+            return '%s:%s' % (cred_type, value.lower())
+    return None
+
+def _client_addr():
+    proxies = current_app.config["RATELIMIT_TRUSTED_PROXIES"]
+    if proxies:
+        forwarded = [a.strip() for a in
+                request.headers.get('X-Forwarded-For', '').split(',')]
+        # the last proxy appends the peer it got the request from
+        if len(forwarded) >= proxies and forwarded[-proxies]:
+            return forwarded[-proxies]
+    return request.remote_addr
+
+KEYS = {
+        'ip': _client_addr,
+        'uid': lambda: request.values.get('uid') or None,
+        'credential': _credential,
+    }
+
+class LocalBackend(object):
+    """
+    Buckets of this process. Keys are spread over stripes, each with its own
+    lock, so that concurrent requests seldom wait for each other. Buckets
+    which have filled up again are swept once a stripe grows past
+    max_keys / stripes.
+    """
+
+    stripes = 64
+
+    def __init__(self, max_keys=100000):
+        self.max_stripe_keys = max(1, max_keys // self.stripes)
+        self._stripes = [({}, threading.Lock()) for _ in range(self.stripes)]
+
+    def consume(self, key, count, period, now=None):
+        now = now or time.time()
+        rate = float(count) / period
+        buckets, lock = self._stripes[hash(key) % self.stripes]
+
+        with lock:
+            bucket = buckets.get(key)
+            if bucket is None:
+                tokens = count
+            else:
+                tokens = min(count, bucket[0] + (now - bucket[1]) * rate)
+
+            if tokens >= 1:
+                tokens -= 1
+                wait = 0
+            else:
+                wait = (1 - tokens) / rate
+
+            # bucket: (tokens, updated, time at which it is full again)
+            buckets[key] = (tokens, now, now + (count - tokens) / rate)
+            if len(buckets) > self.max_stripe_keys:
+                self.sweep(buckets, now)
+
+        return wait
+
+    def sweep(self, buckets, now):
+        for key in [k for k, b in buckets.items() if b[2] <= now]:
+            del buckets[key]
+
+_backend = None
+
+def get_backend():
+    global _backend
+
+    if _backend is None:
+        factory = current_app.config["RATELIMIT_BACKEND"]
+        if factory:
+            import importlib
+            module, name = factory.split(':')
+            _backend = getattr(importlib.import_module(module), name)(
+                    current_app._get_current_object())
+        else:
+            _backend = LocalBackend(current_app.config["RATELIMIT_MAX_KEYS"])
+
+    return _backend
+
+def reset():
+    global _backend
+    _backend = None
+
+def check(endpoint, limits):
+    backend = None
+    for limit in limits:
+        value = KEYS[limit.key]()
+        if value is None:
+            continue
+
+        backend = backend or get_backend()
+        wait = backend.consume('%s:%s:%s' % (endpoint, limit.key, value),
+                limit.count, limit.period)
+        if wait:
+            raise TooManyRequests(wait)
+
+def rate_limited(view):
+    """Api decorator enforcing the rate_limits of resources."""
+    limits = getattr(getattr(view, 'view_class', None), 'rate_limits', None)
+    if not limits:
+        return view
+
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        if current_app.config["RATELIMIT_ENABLED"]:
+            check(request.endpoint, limits.get(request.method, ()))
+        return view(*args, **kwargs)
+
+    return wrapper
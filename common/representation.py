@@ -0,0 +1,53 @@
+# JSON encoding of API responses, selected with API_JSON_ENCODER.
+#
+# Every encoder turns the dict a resource returns into the UTF-8 bytes of
+# compact JSON. "json" (the standard library) is always there; "ujson" and
+# "orjson" are registered when those packages are installed.
+
+import json
+
+from flask import current_app
+
+_encoders = {}
+
+def register(name, dumps):
+    _encoders[name] = dumps
+
+def get_encoder(name):
+    if name not in _encoders:
+        raise ValueError("Unknown JSON encoder %r, available: %s" % (
+                name, ", ".join(encoders())))
+    return _encoders[name]
+
+def encoders():
+    return sorted(_encoders.keys())
+
+def representation(dumps):
+    """Flask-RESTful representation writing bodies with dumps."""
+
+    def output_json(data, code, headers=None):
+        response = current_app.response_class(dumps(data), code,
+                mimetype='application/json')
+        response.headers.extend(headers or {})
+        return response
+
+    return output_json
+
+################################################################################
+# Encoders
+
+register("json", lambda o: json.dumps(o, ensure_ascii=False,
+        separators=(',', ':')).encode('utf8'))
+
+try:
+    import ujson
+    register("ujson", lambda o: ujson.dumps(o, ensure_ascii=False)
+            .encode('utf8'))
+except ImportError:
+    pass
+
+try:
+    import orjson
+    register("orjson", orjson.dumps)
+except ImportError:
+    pass
@@ -0,0 +1,55 @@
+# Session serializers. DO NOT IMPORT FLASK BASED LIBRARIES IN THIS FILE
+#
+# Every format but the legacy pickle one writes a one byte tag in front of its
+# payload, so rows written by any registered format can be decoded whatever
+# SESSION_SERIALIZER is currently set to. Pickle output (protocol >= 2) always
+# starts with b'\x80', which is why untagged rows are taken as pickle.
+
+import json
+import marshal
+import pickle
+
+_PICKLE_TAG = b'\x80'
+
+_formats = {}
+_tags = {}
+
+def register(name, tag, dumps, loads):
+    assert len(tag) == 1 and tag != _PICKLE_TAG
+    _formats[name] = (tag, dumps)
+    _tags[tag] = loads
+
+def dumps(d, fmt="pickle"):
+    if fmt != "pickle":
+        tag, func = _formats[fmt]
+        try:
+            return tag + func(d)
+        except (ValueError, TypeError):
+            pass # values the format can't carry, fall back to pickle
+
+    return pickle.dumps(d, protocol=2)
+
+def loads(data):
+    data = bytes(data)
+    tag = data[:1]
+    if tag == _PICKLE_TAG:
+        return pickle.loads(data)
+    if tag not in _tags:
+        raise ValueError("Unknown session format tag %r" % tag)
+    return _tags[tag](data[1:])
+
+def formats():
+    return ["pickle"] + sorted(_formats.keys())
+
+################################################################################
+# Formats
+
+# marshal version 2 is stable across Python releases and only carries plain
+# types, which is all Flask-Login keeps in a session.
+register("marshal", b'M',
+        lambda d: marshal.dumps(d, 2),
+        marshal.loads)
+
+register("json", b'J',
+        lambda d: json.dumps(d, separators=(',', ':')).encode('utf8'),
+        lambda b: json.loads(b.decode('utf8')))
@@ -0,0 +1,123 @@
+# Static files served from an index built once at startup, see STATIC_INDEX.
+#
+# Every file of the static folder is read and hashed up front, and the ones
+# which compress well are gzipped (and brotli compressed, if the brotli package
+# is installed) at the same time. Requests are then answered from memory
+# without touching the filesystem. Files above STATIC_MEMORY_LIMIT are only
+# hashed, and streamed with the server's sendfile support when requested.
+
+import gzip
+import hashlib
+import mimetypes
+import os
+
+from flask import Response, abort, request, send_file
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+_COMPRESSIBLE = ('text/', 'application/javascript', 'application/json',
+        'application/xml', 'image/svg+xml')
+_MIN_COMPRESS_SIZE = 256
+
+# preferred content codings first
+_CODINGS = ['br', 'gzip']
+
+class StaticFile(object):
+
+    def __init__(self, path, name, memory_limit):
+        stat = os.stat(path)
+
+        self.path = path
+        self.mimetype = mimetypes.guess_type(name)[0] or \
+                'application/octet-stream'
+        self.size = stat.st_size
+        self.mtime = stat.st_mtime
+        self.data = None
+        self.variants = {} # content coding -> body
+
+        digest = hashlib.sha1()
+        with open(path, 'rb') as f:
+            if self.size <= memory_limit:
+                self.data = f.read()
+                digest.update(self.data)
+            else:
+                for chunk in iter(lambda: f.read(65536), b''):
+                    digest.update(chunk)
+        self.etag = digest.hexdigest()
+
+        if self.data is not None and self.size >= _MIN_COMPRESS_SIZE and \
+                self.mimetype.startswith(_COMPRESSIBLE):
+            self.compress()
+
+    def compress(self):
+        variants = { 'gzip': gzip.compress(self.data, 9) }
+        if brotli is not None:
+            variants['br'] = brotli.compress(self.data)
+
+        # keep only the variants worth sending
+        for coding, body in variants.items():
+            if len(body) < self.size:
+                self.variants[coding] = body
+
+    def select(self, accept_encodings):
+        for coding in _CODINGS:
+            if coding in self.variants and accept_encodings[coding]:
+                return coding, self.variants[coding]
+        return None, self.data
+
+class StaticIndex(object):
+    """
+    Mapping of the paths under folder, relative and '/' separated, to their
+    StaticFile. Changes made to the folder afterwards are not seen.
+    """
+
+    def __init__(self, folder, memory_limit=1024 * 1024):
+        self.folder = folder
+        self.files = {}
+
+        for root, dirs, names in os.walk(folder):
+            for name in names:
+                path = os.path.join(root, name)
+                key = os.path.relpath(path, folder).replace(os.sep, '/')
+                self.files[key] = StaticFile(path, key, memory_limit)
+
+    def lookup(self, filename):
+        if not os.path.splitext(filename)[1]:
+            filename += ".html"
+        return self.files.get(filename)
+
+    def response(self, filename, max_age=0, immutable=False):
+        static = self.lookup(filename)
+        if static is None:
+            abort(404)
+
+        coding, body = static.select(request.accept_encodings)
+        if body is None:
+            # too large to be kept in memory
+            resp = send_file(static.path, mimetype=static.mimetype,
+                    add_etags=False)
+        else:
+            resp = Response(body, mimetype=static.mimetype)
+
+        if coding is not None:
+            resp.headers['Content-Encoding'] = coding
+        if static.variants:
+            resp.vary.add('Accept-Encoding')
+
+        # each coding is a different representation
+        resp.set_etag(static.etag if coding is None
+                else '%s-%s' % (static.etag, coding))
+        resp.last_modified = static.mtime
+        resp.expires = None
+
+        if static.mimetype == 'text/html':
+            # pages name the assets, have them revalidated every time
+            resp.headers['Cache-Control'] = 'no-cache'
+        else:
+            resp.headers['Cache-Control'] = 'public, max-age=%d%s' % \
+                    (max_age, ', immutable' if immutable else '')
+
+        return resp.make_conditional(request)
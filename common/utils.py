@@ -2,6 +2,8 @@ import os, re
 
 from flask import Blueprint
 
+_MODULE_RE = re.compile(r"^[a-zA-Z][a-zA-Z0-9_]*$")
+
 def find_modules(init_file, fpattern = None):
     """
     List names of modules in the same directory as init_file. The function is
@@ -11,8 +13,7 @@ def find_modules(init_file, fpattern = None):
 
     import pkgutil
 
-    fpattern = re.compile(r"^[a-zA-Z][a-zA-Z0-9_]*$") \
-            if fpattern is None else re.compile(fpattern)
+    fpattern = _MODULE_RE if fpattern is None else re.compile(fpattern)
 
     dirname = os.path.dirname(init_file)
     parmod = os.path.dirname(dirname)
@@ -57,89 +58,505 @@ def join_url(*args, **kwargs):
 ################################################################################
 # Request Argument Conversion and Validation
 
+_EMAIL_RE = re.compile(r"^[^@]+@[a-zA-Z0-9\-_\.]+$")
+_PHONE_RE = re.compile(r"^\d+$")
+_MD5_RE = re.compile(r"(^$)|(^[a-zA-Z0-9]{32}$)")
+
+def name_type(name_str):
+    if name_str:
+        return name_str
+    else:
+        raise ValueError("Missing name.")
+
 def email_type(email_str):
-    if re.match("^[^@]+@[a-zA-Z0-9\-_\.]+$", email_str):
+    if _EMAIL_RE.match(email_str):
         return email_str
     else:
         raise ValueError("Not a Proper Email.")
 
 def phone_type(phone_str):
-    if re.match("^\d+$", phone_str):
+    if _PHONE_RE.match(phone_str):
         return phone_str
     else:
         raise ValueError("Not a Proper Phone Number.")
 
 def md5_hashed_type(mhstr):
-    if re.match("(^$)|(^[a-zA-Z0-9]{32}$)", mhstr):
+    if _MD5_RE.match(mhstr):
         return mhstr
     else:
         raise ValueError("Not MD5 Hashed.")
 
+def json_array_type(value):
+    # list() would take a string or an object too
+    if isinstance(value, list):
+        return value
+    else:
+        raise ValueError("Not a JSON Array.")
+
+def arguments(*args):
+    """
+    Declare the arguments of a resource method. The parser is built once, when
+    the resource class is defined, and the parsed arguments are passed to the
+    method after self:
+
+        @arguments(
+            Argument('uid'),
+            Argument('email', type=email_type),
+        )
+        def post(self, args):
+            ...
+
+    """
+    import functools
+    from flask_restful.reqparse import RequestParser
+
+    parser = RequestParser()
+    for arg in args:
+        parser.add_argument(arg)
+
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(self, *args, **kwargs):
+            return func(self, parser.parse_args(), *args, **kwargs)
+
+        wrapper.parser = parser
+        return wrapper
+
+    return decorator
+
+################################################################################
+# Conditional Requests
+
+def not_modified(etag, last_modified=None):
+    """
+    The 304 response answering the current request if it already has this
+    version, otherwise None.
+
+    If-None-Match wins when both validators are sent. If-Modified-Since only
+    has a one second resolution: a change made within the second of the
+    response the client holds goes unnoticed, so prefer the ETag.
+    """
+    from flask import request, Response
+
+    if request.if_none_match:
+        fresh = etag in request.if_none_match
+    elif last_modified and request.if_modified_since:
+        # HTTP dates don't carry microseconds
+        fresh = last_modified.replace(microsecond=0) <= \
+                request.if_modified_since.replace(tzinfo=None)
+    else:
+        fresh = False
+
+    if not fresh:
+        return None
+
+    response = Response(status=304)
+    response.set_etag(etag)
+    return response
+
+_VERSION_KEY = 'assoplat.version'
+
+def set_version(key, last_modified=None):
+    """
+    Tell conditional which version of the state the current view answers
+    with, see there.
+    """
+    from flask import request
+    request.environ[_VERSION_KEY] = (key, last_modified)
+
+def conditional(view):
+    """
+    Api decorator answering conditional GETs of resources which declare
+
+        @classmethod
+        def version_key(cls):
+            return key, last_modified
+
+    key is anything cheap identifying the state a GET would return with its
+    repr(), last_modified a UTC datetime or None. version_key is only called
+    when the request carries a validator; when the client has that version
+    the view isn't called at all. version_key may return None when it can't
+    tell. Views report the version they answer with through set_version(),
+    which gives their response its ETag and Last-Modified.
+
+    Keys must tell apart the state of different users when the view depends
+    on the logged in one; responses vary on the cookie.
+    """
+    import functools
+    import hashlib
+    from flask import request
+
+    def etag_for(key):
+        return hashlib.md5(repr((request.path,
+            sorted(request.values.items(multi=True)), key))
+            .encode('utf8')).hexdigest()
+
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        version_key = getattr(getattr(view, 'view_class', None),
+                'version_key', None)
+        if version_key is None or request.method not in ('GET', 'HEAD'):
+            return view(*args, **kwargs)
+
+        version = None
+        if request.if_none_match or request.if_modified_since:
+            version = version_key()
+            if version is not None:
+                response = not_modified(etag_for(version[0]), version[1])
+                if response is not None:
+                    response.vary.add('Cookie')
+                    return response
+
+        response = view(*args, **kwargs)
+        response.vary.add('Cookie')
+
+        version = request.environ.get(_VERSION_KEY, version)
+        if response.status_code == 200 and version is not None:
+            key, last_modified = version
+            response.set_etag(etag_for(key))
+            if last_modified:
+                response.last_modified = last_modified
+        return response
+
+    return wrapper
+
+################################################################################
+# Relationship Loading
+
+def load_options(model, strategies):
+    """
+    Turn a {relationship: strategy} dict into query options, where strategy
+    is one of 'joined', 'selectin', 'subquery', 'lazy' or 'noload'.
+    """
+    from sqlalchemy import orm
+
+    loaders = {
+            'joined': orm.joinedload,
+            'selectin': orm.selectinload,
+            'subquery': orm.subqueryload,
+            'lazy': orm.lazyload,
+            'noload': orm.noload,
+        }
+
+    return [loaders[strategy](getattr(model, rel))
+            for rel, strategy in strategies.items()]
+
+def view_attribute(app, endpoint, name, default=None):
+    """
+    Look name up on the view function of endpoint, then on its view class.
+    """
+    view = app.view_functions.get(endpoint)
+    if view is None:
+        return default
+    if hasattr(view, name):
+        return getattr(view, name)
+    return getattr(getattr(view, 'view_class', None), name, default)
+
+################################################################################
+# Model Snapshots
+
+def detached_copy(obj, *relationships):
+    """
+    Copy the loaded columns of obj, and of the named relationships if they
+    are loaded, into new detached instances. The copy can be shared between
+    threads and attached to any session with session.merge(copy, load=False).
+    """
+    from sqlalchemy import inspect
+    from sqlalchemy.orm import make_transient_to_detached
+    from sqlalchemy.orm.attributes import set_committed_value
+
+    state = inspect(obj)
+    copy = state.mapper.class_()
+    for attr in state.mapper.column_attrs:
+        if attr.key in state.dict:
+            setattr(copy, attr.key, state.dict[attr.key])
+    make_transient_to_detached(copy)
+
+    for rel in relationships:
+        if rel not in state.dict:
+            continue
+        value = state.dict[rel]
+        set_committed_value(copy, rel,
+                detached_copy(value) if value is not None else None)
+
+    return copy
+
+################################################################################
+# Background Tasks
+
+import atexit
+import threading
+
+class PeriodicThread(threading.Thread):
+    """
+    Daemon thread calling func every interval seconds until stop() is called,
+    the first time after delay seconds (interval by default).
+    """
+
+    def __init__(self, interval, func, name=None, delay=None):
+        threading.Thread.__init__(self, name=name)
+        self.daemon = True
+        self.interval = interval
+        self.delay = interval if delay is None else delay
+        self.func = func
+        self.stopped = threading.Event()
+
+    def run(self):
+        delay = self.delay
+        while not self.stopped.wait(delay):
+            delay = self.interval
+            try:
+                self.func()
+            except Exception:
+                import logging
+                logging.getLogger(__name__).exception(
+                        "%s failed", self.name)
+
+    def stop(self):
+        self.stopped.set()
+
 ################################################################################
 # Session Interface
 
-import pickle
+import time
 import uuid
 
+from datetime import datetime
 from werkzeug.datastructures import CallbackDict
 from flask.sessions import SessionInterface, SessionMixin
 
+from . import serializer as session_serializer
+from .instrument import timed
+from .database import mark_write
+
+def admin_only(func):
+    """
+    Let only operators call a resource method: requests have to carry
+    ADMIN_TOKEN in the X-Admin-Token header. The method isn't found at all
+    while no ADMIN_TOKEN is configured.
+    """
+    import functools
+    import hmac
+    from flask import abort, current_app, request
+    from .error import AdminTokenRequired
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        token = current_app.config["ADMIN_TOKEN"]
+        if not token:
+            abort(404)
+        if not hmac.compare_digest(
+                request.headers.get('X-Admin-Token', '').encode('utf8'),
+                token.encode('utf8')):
+            raise AdminTokenRequired()
+        return func(*args, **kwargs)
+
+    return wrapper
+
+def stateless(view):
+    """
+    Mark a view function or resource as not using the session: it is neither
+    loaded nor saved, and current_user is always anonymous in it.
+    """
+    view.stateless = True
+    return view
+
 class DatabaseSession(CallbackDict, SessionMixin):
     @staticmethod
     def _update(self):
         self.modified = True
 
-    def __init__(self, initial=None, sid=None, new=False):
+    def __init__(self, initial=None, sid=None, new=False, expiry=None,
+            stateless=False):
         CallbackDict.__init__(self, initial, self._update)
         self.sid = sid if sid else self.get_session_id()
         self.new = new
+        self.expiry = expiry
         self.modified = False
+        self.loaded = True
+        # neither loaded nor saved, for views marked stateless
+        self.stateless = stateless
 
     @staticmethod
     def get_session_id():
         return str(uuid.uuid4())
 
+class LazyDatabaseSession(DatabaseSession):
+    """
+    Session of a known sid, whose data is only fetched on first use. loader
+    returns (initial, expiry, new).
+    """
+
+    def __init__(self, sid, loader):
+        DatabaseSession.__init__(self, sid=sid)
+        self.loader = loader
+        self.loaded = False
+
+    def load(self):
+        if not self.loaded:
+            self.loaded = True
+            initial, self.expiry, self.new = self.loader()
+            dict.update(self, initial or {})
+
+def _loading(name):
+    method = getattr(DatabaseSession, name)
+
+    def wrapper(self, *args, **kwargs):
+        self.load()
+        return method(self, *args, **kwargs)
+
+    wrapper.__name__ = name
+    return wrapper
+
+for _name in ['__getitem__', '__setitem__', '__delitem__', '__contains__',
+        '__iter__', '__len__', '__eq__', '__ne__', '__repr__', 'get', 'keys',
+        'values', 'items', 'setdefault', 'pop', 'popitem', 'update', 'clear',
+        'copy']:
+    setattr(LazyDatabaseSession, _name, _loading(_name))
+
 class DatabaseSessionInterface(SessionInterface):
-    serializer = lambda s, d: pickle.dumps(d, protocol=2)
-    unserializer = lambda s, d: pickle.loads(d)
+    serializer = lambda s, d, fmt="pickle": session_serializer.dumps(d, fmt)
+    unserializer = lambda s, d: session_serializer.loads(d)
     session_class = DatabaseSession
 
+    flush_chunk_size = 500
+
     def __init__(self, db, table):
         self.db = db
         self.session_table = table
 
+        # sid -> (data, expiry), waiting for the background flusher
+        self.pending = {}
+        self.flushing = {}
+        self.pending_lock = threading.Lock()
+        # one flush at a time, each owns self.flushing while it runs
+        self.flush_lock = threading.Lock()
+        self.flusher = None
+
+        self.cache = None
+
+    def get_cache(self, app):
+        if self.cache is None and app.config["SESSION_CACHE_SIZE"]:
+            from .cache import LRUCache
+            self.cache = LRUCache(app.config["SESSION_CACHE_SIZE"],
+                    ttl=app.config["SESSION_CACHE_TTL"])
+        return self.cache
+
+    def cache_session(self, app, sid, initial, expiry):
+        cache = self.get_cache(app)
+        if cache is not None:
+            cache.set(sid, (initial, expiry), ttl=
+                    (expiry - datetime.utcnow()).total_seconds()
+                    if expiry else None)
+
     def open_session(self, app, request):
+        with timed('session_load'):
+            return self.load_session(app, request)
+
+    def is_stateless(self, app, request):
+        """
+        Whether the view is marked stateless, or its blueprint is listed in
+        SESSION_STATELESS_BLUEPRINTS.
+        """
+        blueprint = request.blueprint or ''
+        for name in app.config["SESSION_STATELESS_BLUEPRINTS"]:
+            if blueprint == name or blueprint.startswith(name + '.'):
+                return True
+        return view_attribute(app, request.endpoint, 'stateless', False)
+
+    def load_session(self, app, request):
+        if self.is_stateless(app, request):
+            return DatabaseSession(new=True, stateless=True)
+
         sid = request.cookies.get(app.session_cookie_name)
         if not sid:
             return DatabaseSession(new=True)
 
-        session_record = self.session_table.query.get(sid)
-        if not session_record:
-            return DatabaseSession(sid=sid, new=True)
-
-        initial = self.unserializer(session_record.data)
-        return DatabaseSession(sid=sid, initial=initial)
+        # only looked up once the view reads session or current_user
+        return LazyDatabaseSession(sid, lambda: self.fetch_session(app, sid))
+
+    def fetch_session(self, app, sid):
+        with timed('session_load'):
+            cache = self.get_cache(app)
+            cached = cache.get(sid) if cache is not None else None
+            if cached:
+                initial, expiry = cached
+                return initial, expiry, False
+
+            with self.pending_lock:
+                buffered = self.pending.get(sid) or self.flushing.get(sid)
+            if buffered:
+                data, expiry = buffered
+            else:
+                session_record = self.session_table.query.get(sid)
+                if not session_record:
+                    return None, None, True
+                data, expiry = session_record.data, session_record.expiry
+
+            initial = self.unserializer(data)
+            self.cache_session(app, sid, initial, expiry)
+            return initial, expiry, False
+
+    def should_write(self, app, session):
+        if session.modified:
+            return True
+        if session.new:
+            return False
+
+        # refresh the stored expiry once half of the lifetime has passed
+        return session.expiry is None or session.expiry - datetime.utcnow() \
+                < app.permanent_session_lifetime // 2
 
     def save_session(self, app, session, response):
-        from flask import current_app
-        from datetime import datetime
+        with timed('session_save'):
+            self.store_session(app, session, response)
 
+    def store_session(self, app, session, response):
         assert isinstance(session, self.session_class)
+        # untouched, or new and empty: leave the cookie and the row alone
+        if session.stateless or not session.loaded or \
+                (session.new and not session.modified):
+            return
 
         # cookie properties
-        domain = self.get_cookie_domain(current_app)
-        path = self.get_cookie_path(current_app)
-        httponly = self.get_cookie_httponly(current_app)
-        secure = self.get_cookie_secure(current_app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+        httponly = self.get_cookie_httponly(app)
+        secure = self.get_cookie_secure(app)
 
         sid = session.sid
-        data = self.serializer(dict(session))
-        expiry = self.get_expiration_time(current_app, session)
+        expiry = self.get_expiration_time(app, session)
+
+        if self.should_write(app, session):
+            data = self.serializer(dict(session),
+                    app.config["SESSION_SERIALIZER"])
+            # browser-linked sessions still expire on the server side
+            record_expiry = expiry or \
+                    datetime.utcnow() + app.permanent_session_lifetime
+
+            if app.config["SESSION_WRITE_BEHIND"]:
+                self.write_behind(app, sid, data, record_expiry)
+            else:
+                self.write_through(sid, data, record_expiry)
+            self.db.pin_to_primary(response)
+
+            # replaces whatever the cache held for this sid
+            self.cache_session(app, sid, dict(session), record_expiry)
 
+        response.set_cookie(app.session_cookie_name, sid,
+                expires = expiry,
+                domain = domain,
+                path = path,
+                httponly = httponly,
+                secure = secure
+            )
+
+    def write_through(self, sid, data, expiry):
         # clear the session
         self.db.session.rollback()
 
-        session_record = self.session_table.query.get(sid)
+        with self.db.primary():
+            session_record = self.session_table.query.get(sid)
         if session_record:
             session_record.data = data
             session_record.expiry = expiry
@@ -153,19 +570,139 @@ class DatabaseSessionInterface(SessionInterface):
 
         self.db.session.commit()
 
-        response.set_cookie(current_app.session_cookie_name, sid,
-                expires = expiry,
-                domain = domain,
-                path = path,
-                httponly = httponly,
-                secure = secure
-            )
+    def write_behind(self, app, sid, data, expiry):
+        mark_write()
+
+        with self.pending_lock:
+            self.pending[sid] = (data, expiry)
+
+            if self.flusher is None:
+                self.flusher = PeriodicThread(
+                        app.config["SESSION_FLUSH_INTERVAL"],
+                        lambda: self.flush(app),
+                        name="session-flusher")
+                self.flusher.start()
+                atexit.register(self.flush, app)
+
+    def flush(self, app):
+        """
+        Upsert all buffered sessions in chunks. Returns the number of rows
+        written.
+        """
+        with self.flush_lock:
+            return self._flush(app)
+
+    def _flush(self, app):
+        from sqlalchemy import select, bindparam
+
+        with self.pending_lock:
+            self.flushing, self.pending = self.pending, {}
+            batch = list(self.flushing.items())
+        if not batch:
+            return 0
+
+        table = self.session_table.__table__
+        update = table.update() \
+                .where(table.c.sid == bindparam('_sid')) \
+                .values(data=bindparam('data'), expiry=bindparam('expiry'))
+
+        try:
+            with self.db.get_engine(app).begin() as conn:
+                for i in range(0, len(batch), self.flush_chunk_size):
+                    chunk = batch[i:i + self.flush_chunk_size]
+                    existing = set(r[0] for r in conn.execute(
+                        select([table.c.sid]).where(
+                            table.c.sid.in_([sid for sid, _ in chunk]))))
+
+                    updates = [{ '_sid': sid, 'data': d, 'expiry': e }
+                            for sid, (d, e) in chunk if sid in existing]
+                    inserts = [{ 'sid': sid, 'data': d, 'expiry': e }
+                            for sid, (d, e) in chunk if sid not in existing]
+
+                    if updates: conn.execute(update, updates)
+                    if inserts: conn.execute(table.insert(), inserts)
+        except Exception:
+            # put back what has not been superseded meanwhile
+            with self.pending_lock:
+                for sid, record in batch:
+                    self.pending.setdefault(sid, record)
+            raise
+        finally:
+            with self.pending_lock:
+                self.flushing = {}
+
+        return len(batch)
+
+    def reap(self, app, batch_size=1000, now=None):
+        """
+        Delete expired sessions, batch_size rows per transaction so that no
+        lock is held for long. Returns statistics of the run.
+
+        Rows without an expiry, written before sessions got one, first get
+        a full lifetime from now: their age is unknown, and the next run
+        after that deletes those which were not used meanwhile.
+        """
+        from sqlalchemy import select
+
+        table = self.session_table.__table__
+        engine = self.db.get_engine(app)
+        now = now or datetime.utcnow()
+
+        backfilled = 0
+        backfill_expiry = now + app.permanent_session_lifetime
+        while True:
+            with engine.begin() as conn:
+                sids = [r[0] for r in conn.execute(
+                    select([table.c.sid]).where(table.c.expiry == None)
+                        .limit(batch_size))]
+                if sids:
+                    conn.execute(table.update()
+                            .where(table.c.sid.in_(sids))
+                            .values(expiry=backfill_expiry))
+            backfilled += len(sids)
+            if len(sids) < batch_size:
+                break
+
+        rows = batches = 0
+        lock_time = max_lock_time = 0.0
+        started = time.time()
+
+        while True:
+            begin = time.time()
+            with engine.begin() as conn:
+                sids = [r[0] for r in conn.execute(
+                    select([table.c.sid]).where(table.c.expiry < now)
+                        .order_by(table.c.expiry).limit(batch_size))]
+                if sids:
+                    conn.execute(table.delete().where(table.c.sid.in_(sids)))
+            held = time.time() - begin
+
+            rows += len(sids)
+            batches += 1
+            lock_time += held
+            max_lock_time = max(max_lock_time, held)
+
+            if len(sids) < batch_size:
+                break
+
+        elapsed = time.time() - started
+
+        return {
+                'rows': rows,
+                'batches': batches,
+                'backfilled': backfilled,
+                'seconds': elapsed,
+                'rows_per_sec': rows / elapsed if elapsed else 0.0,
+                'lock_seconds': lock_time,
+                'max_lock_seconds': max_lock_time,
+            }
 
 ################################################################################
 # Test Base Class
 
 import json
 import unittest
+import contextlib
 
 def test_context(func):
     from flask import current_app
@@ -261,6 +798,25 @@ class ApiTest(unittest.TestCase):
     def post(self, **kwargs):
         return self.open('post', **kwargs)
 
+    @contextlib.contextmanager
+    def assertMaxQueries(self, count):
+        from flask import g
+        from sqlalchemy import event
+
+        statements = []
+        def record(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        event.listen(g.db.engine, "before_cursor_execute", record)
+        try:
+            yield statements
+        finally:
+            event.remove(g.db.engine, "before_cursor_execute", record)
+
+        self.assertLessEqual(len(statements), count,
+                "%d queries issued:\n%s" % (
+                    len(statements), "\n".join(statements)))
+
     def assertApiError(self, respdict, errcls):
         self.assertIn("status", respdict)
         self.assertIn("code", respdict["status"])